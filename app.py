@@ -1,11 +1,18 @@
-import os, json, sqlite3
+import os, json, zlib, time, sqlite3, threading
 from datetime import datetime, timedelta
 import pytz
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response
+import click
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import event, exists, select, text, inspect as sa_inspect
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.engine import Engine
+from markupsafe import escape, Markup
+import interactions, search, providers, push, circuit, sharding, backup
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 
 # Load environment variables
 from dotenv import load_dotenv
@@ -15,6 +22,23 @@ app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY","dev-secret")
 app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL","sqlite:///vital_guard_fresh.db")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["RETENTION_REMINDER_DAYS"] = int(os.getenv("RETENTION_REMINDER_DAYS", 30))
+app.config["RETENTION_MEDICATION_DAYS"] = int(os.getenv("RETENTION_MEDICATION_DAYS", 365))
+app.config["RETENTION_PLAN_DAYS"] = int(os.getenv("RETENTION_PLAN_DAYS", 90))
+app.config["RETENTION_BATCH_SIZE"] = int(os.getenv("RETENTION_BATCH_SIZE", 500))
+app.config["PUSH_INTERVAL_SECONDS"] = int(os.getenv("PUSH_INTERVAL_SECONDS", 15))
+app.config["PUSH_KEEPALIVE_SECONDS"] = int(os.getenv("PUSH_KEEPALIVE_SECONDS", 25))
+app.config["PUSH_LOOKAHEAD_DAYS"] = int(os.getenv("PUSH_LOOKAHEAD_DAYS", 7))
+# Accounts allowed to see process-wide metrics such as /api/push/stats
+app.config["OPERATOR_EMAILS"] = {e.strip().lower() for e in os.getenv("OPERATOR_EMAILS", "").split(",") if e.strip()}
+app.config["BACKUP_DIR"] = os.getenv("BACKUP_DIR", os.path.join(app.instance_path, "backups"))
+app.config["BACKUP_KEEP_FULL"] = int(os.getenv("BACKUP_KEEP_FULL", 3))
+app.config["BACKUP_INTERVAL_MINUTES"] = int(os.getenv("BACKUP_INTERVAL_MINUTES", 0))  # 0 = no scheduled backups
+# Incrementals need change-tracking triggers, whose log only shrinks when a snapshot is taken;
+# so by default they are on only with scheduled backups, and one-off snapshots are always full
+app.config["BACKUP_INCREMENTAL"] = os.getenv("BACKUP_INCREMENTAL", "1" if app.config["BACKUP_INTERVAL_MINUTES"] else "0") == "1"
+app.config["PROVIDERS_DATASET"] = os.getenv("PROVIDERS_DATASET", os.path.join(app.root_path, "data", "providers.csv"))
+app.config["INTERACTIONS_DATASET"] = os.getenv("INTERACTIONS_DATASET", os.path.join(app.root_path, "data", "interactions.json"))
 
 # Production configuration
 if os.getenv('FLASK_ENV') == 'production':
@@ -22,21 +46,49 @@ if os.getenv('FLASK_ENV') == 'production':
     if app.config['SQLALCHEMY_DATABASE_URI'] and app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres://'):
         app.config['SQLALCHEMY_DATABASE_URI'] = app.config['SQLALCHEMY_DATABASE_URI'].replace('postgres://', 'postgresql://')
 
-db = SQLAlchemy(app)
+# WAL lets readers (and backups) run without blocking writers; SQLITE_WAL=0 keeps
+# the rollback journal, e.g. for a database on a network filesystem
+if os.getenv("SQLITE_WAL", "1") == "1":
+    @event.listens_for(Engine, "connect")
+    def sqlite_wal(dbapi_conn, record):
+        if isinstance(dbapi_conn, sqlite3.Connection):
+            dbapi_conn.execute("PRAGMA journal_mode=WAL")
+
+# Optional sharding: per-user tables split across these databases by user_id
+SHARD_URLS = [u.strip() for u in os.getenv("SHARD_DATABASE_URLS", "").split(",") if u.strip()]
+SHARD_IDS = sharding.shard_names(len(SHARD_URLS))
+SHARDED_TABLES = ["profile", "reminder", "plan", "medication", "subscription", "interaction_alert", "archive_chunk"]
+shard_router = None
+
+if SHARD_IDS:
+    app.config["SQLALCHEMY_BINDS"] = dict(zip(SHARD_IDS, SHARD_URLS))
+    shard_router = sharding.ShardRouter(SHARD_IDS, SHARDED_TABLES, lambda uid: lookup_user_shard(uid))
+    db = SQLAlchemy(app, session_options={"class_": sharding.make_session_class(lambda: shard_router)})
+    print(f"Sharding per-user tables across {len(SHARD_IDS)} databases")
+else:
+    db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
 
 # OpenAI Setup
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_FAKE = os.getenv("OPENAI_FAKE")  # "latency_ms,error_rate" - local fake client for testing
 USE_OPENAI = bool(OPENAI_API_KEY and OPENAI_API_KEY.startswith(('sk-', 'sk-proj-')))
+OPENAI_DEADLINE_SECONDS = float(os.getenv("OPENAI_DEADLINE_SECONDS", 8))
+OPENAI_HEDGE_MARGIN_SECONDS = float(os.getenv("OPENAI_HEDGE_MARGIN_SECONDS", 0.5))
 client = None
 
 print(f"OpenAI Key: {'Found' if OPENAI_API_KEY else 'Missing'}")
 
-if USE_OPENAI:
+if OPENAI_FAKE:
+    client = circuit.FakeChatClient.from_spec(OPENAI_FAKE)
+    USE_OPENAI = True
+    print(f"Using fake OpenAI client: {OPENAI_FAKE}")
+elif USE_OPENAI:
     try:
         from openai import OpenAI
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        # No client-side retries: OPENAI_DEADLINE_SECONDS is the whole budget
+        client = OpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_DEADLINE_SECONDS, max_retries=0)
         # Test call
         test_resp = client.chat.completions.create(
             model="gpt-3.5-turbo",
@@ -144,6 +196,91 @@ class Subscription(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class InteractionAlert(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    medication_id = db.Column(db.Integer, db.ForeignKey("medication.id"), nullable=False, index=True)
+    # The other medication in the pair; None for allergies and entries from the profile's free text
+    other_medication_id = db.Column(db.Integer, db.ForeignKey("medication.id"), nullable=True, index=True)
+    kind = db.Column(db.String(20), default="interaction")  # interaction, allergy, duplicate
+    severity = db.Column(db.String(20), default="moderate")
+    message = db.Column(db.Text, default="")
+    dataset_version = db.Column(db.String(50), default="")
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ArchiveChunk(db.Model):
+    """Compressed batch of rows moved out of a hot table by the retention job"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)  # reminder, medication, plan
+    row_count = db.Column(db.Integer, default=0)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    payload = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed JSON list of rows
+
+class UserShard(db.Model):
+    """Shard directory on the primary: users moved off their hash shard"""
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    shard_id = db.Column(db.String(50), nullable=False)
+    moved_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+SHARDED_MODELS = [Profile, Reminder, Plan, Medication, Subscription, InteractionAlert, ArchiveChunk]
+
+def lookup_user_shard(user_id):
+    """Directory entry for user_id, cached for the rest of the request"""
+    cache = g.setdefault("user_shards", {}) if has_app_context() else {}
+    if user_id not in cache:
+        with db.engines[None].connect() as conn:
+            cache[user_id] = conn.execute(select(UserShard.shard_id).where(UserShard.user_id == user_id)).scalar()
+    return cache[user_id]
+
+def set_user_shard(user_id, shard_id):
+    with db.engines[None].begin() as conn:
+        conn.execute(UserShard.__table__.delete().where(UserShard.user_id == user_id))
+        conn.execute(UserShard.__table__.insert().values(user_id=user_id, shard_id=shard_id, moved_at=datetime.utcnow()))
+    if has_app_context():
+        g.pop("user_shards", None)
+
+def shard_ids_or_none():
+    """Shards to loop over for whole-table work; [None] when sharding is off"""
+    return SHARD_IDS or [None]
+
+def data_engines():
+    """Engines that hold per-user rows"""
+    return [db.engines[sid] for sid in SHARD_IDS] if SHARD_IDS else [db.engine]
+
+def shard_connection(shard_id):
+    """Session connection to one shard, or to the only database when shard_id is None"""
+    if shard_id is None:
+        return db.session.connection()
+    return db.session.connection(bind_arguments={"shard_id": shard_id})
+
+def user_connection(user_id):
+    """Session connection to the database holding user_id's rows"""
+    return shard_connection(shard_router.shard_for_user(user_id) if SHARD_IDS else None)
+
+@event.listens_for(Session, "after_flush")
+def check_user_shards(session, flush_context):
+    """Fail writes that raced with a move of the same user to another shard"""
+    if shard_router is None:
+        return
+    written = {}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        token = sa_inspect(obj).identity_token
+        if token in SHARD_IDS:
+            written[obj.user_id] = token
+    for uid, shard_id in written.items():
+        sharding.check_owner(session.connection(bind_arguments={"shard_id": shard_id}), uid)
+
+@app.errorhandler(sharding.UserMoved)
+def user_moved(e):
+    """A write raced with a move of this user to another shard; nothing was saved"""
+    db.session.rollback()
+    if request.path.startswith("/api/") or request.is_json:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+    flash("Your data was being moved just now and that change was not saved. Please try again.", "error")
+    back = request.referrer if request.method == "POST" else None
+    return redirect(back or url_for("index"))
+
 @login_manager.user_loader
 def load_user(uid): 
     return db.session.get(User, int(uid))
@@ -156,6 +293,12 @@ def bootstrap_db():
         
         # NUCLEAR OPTION: Always delete and recreate for development
         if os.path.exists(db_abs_path) and os.getenv('FLASK_ENV') != 'production':
+            try:
+                for path, kind, rows in take_snapshots(full=True):
+                    print(f"Saved {rows} rows to {path} (flask --app app restore-snapshot to get them back)")
+            except Exception as e:
+                print(f"Could not snapshot the old database: {e}")
+            db.engine.dispose()
             print(f"Force deleting existing database: {db_abs_path}")
             os.remove(db_abs_path)
         
@@ -164,10 +307,102 @@ def bootstrap_db():
         if os.path.exists(journal_path):
             os.remove(journal_path)
         
+        # Shard files are reset with the primary so ids stay consistent
+        for url in SHARD_URLS:
+            shard_path = os.path.abspath(url.replace("sqlite:///", "")) if url.startswith("sqlite:///") else None
+            if shard_path and os.path.exists(shard_path) and os.getenv('FLASK_ENV') != 'production':
+                os.remove(shard_path)
+
         print("Creating completely fresh database...")
-        db.create_all()
+        if SHARD_IDS:
+            db.create_all(bind_key=None)
+            for sid in SHARD_IDS:
+                sharding.create_shard_tables(db.engines[sid], [m.__table__ for m in SHARDED_MODELS])
+        else:
+            db.create_all()
+        ensure_search_schema()
         print(f"Fresh database created at: {db_abs_path}")
 
+# Full-text search index, kept in sync on every flush
+_search_schema_ready = set()
+
+def ensure_search_schema(conn=None):
+    """Create the index on conn's database, or on every database with per-user rows"""
+    if conn is None:
+        for engine in data_engines():
+            if str(engine.url) not in _search_schema_ready:
+                with engine.begin() as c:
+                    ensure_search_schema(c)
+        return
+    key = str(conn.engine.url)
+    if key in _search_schema_ready:
+        return
+    if search.ensure_schema(conn):
+        print(f"Search index on {conn.engine.url} used the old layout and was dropped; run flask --app app rebuild-search-index")
+    _search_schema_ready.add(key)
+
+def search_document_for(obj):
+    """Return (doc_type, title, body) for a searchable model instance, or None"""
+    if isinstance(obj, Medication):
+        return "medication", obj.name, " ".join(filter(None, [obj.dosage, obj.frequency, obj.prescribed_by, obj.condition_for, obj.notes]))
+    if isinstance(obj, Reminder):
+        return "reminder", obj.title, " ".join(filter(None, [obj.kind, obj.notes]))
+    if isinstance(obj, Plan):
+        return "plan", f"{(obj.kind or 'plan').title()} plan", obj.content
+    if isinstance(obj, Profile):
+        return "profile", "Profile notes", " ".join(filter(None, [obj.conditions, obj.goals, obj.diet_prefs, obj.activity_limits, obj.notes]))
+    return None
+
+@event.listens_for(Session, "after_flush")
+def sync_search_index(session, flush_context):
+    changed = [o for o in list(session.new) + list(session.dirty) if search_document_for(o)]
+    deleted = [o for o in session.deleted if search_document_for(o)]
+    if not changed and not deleted:
+        return
+    def connection_for(obj):
+        # The index lives next to the rows, on the shard the object was flushed to
+        if shard_router is None:
+            return session.connection()
+        shard_id = sa_inspect(obj).identity_token or shard_router.shard_for_user(obj.user_id)
+        return session.connection(bind_arguments={"shard_id": shard_id})
+
+    for obj in changed:
+        conn = connection_for(obj)
+        ensure_search_schema(conn)
+        doc_type, title, body = search_document_for(obj)
+        search.upsert_document(conn, doc_type, obj.id, obj.user_id, title, body)
+    for obj in deleted:
+        conn = connection_for(obj)
+        ensure_search_schema(conn)
+        search.delete_document(conn, search_document_for(obj)[0], obj.id, obj.user_id)
+
+def rebuild_search_index(batch_size=1000):
+    """Re-index every searchable row, e.g. for databases created before search existed"""
+    ensure_search_schema()
+    total = 0
+    for shard_id in shard_ids_or_none():
+        for model in (Medication, Reminder, Plan, Profile):
+            last_id = 0
+            while True:
+                rows = sharding.on_shard(model.query.filter(model.id > last_id).order_by(model.id.asc()).limit(batch_size), shard_id).all()
+                if not rows:
+                    break
+                search.upsert_documents(shard_connection(shard_id),
+                                        [(doc_type, obj.id, obj.user_id, title, body)
+                                         for obj in rows for doc_type, title, body in [search_document_for(obj)]])
+                db.session.commit()
+                total += len(rows)
+                last_id = rows[-1].id
+    return total
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Index all medications, reminders, plans and profile notes"""
+    print(f"Indexed {rebuild_search_index()} documents")
+
+def is_operator(user):
+    return bool(user and user.is_authenticated and user.email.lower() in app.config["OPERATOR_EMAILS"])
+
 def user_has_active_subscription(user):
     """Check if user has active subscription"""
     if not user or not user.is_authenticated:
@@ -230,6 +465,511 @@ def build_profile_context(profile):
     
     return ". ".join(parts) if parts else "Healthy individual"
 
+# Interaction checks
+def interaction_index():
+    return interactions.get_index(app.config["INTERACTIONS_DATASET"])
+
+def check_against(index, name, meds, profile_meds, allergies):
+    """index.check() with each finding's other_id set to the Medication it pairs with, if any"""
+    ids = {}
+    for m in meds:
+        ids.setdefault(m.name, m.id)
+    findings = index.check(name, [m.name for m in meds] + profile_meds, allergies)
+    for f in findings:
+        f["other_id"] = ids.get(f["other"]) if f["kind"] != "allergy" else None
+    return findings
+
+def check_new_medication(user_id, name, exclude_id=None):
+    """Check a medication name against the user's active list and allergies"""
+    prof = Profile.query.filter_by(user_id=user_id).first()
+    meds = [m for m in Medication.query.filter_by(user_id=user_id, active=True).all() if m.id != exclude_id]
+    profile_meds = interactions.split_free_text(prof.medications) if prof else []
+    allergies = interactions.split_free_text(prof.allergies) if prof else []
+    return check_against(interaction_index(), name, meds, profile_meds, allergies)
+
+def new_interaction_alert(user_id, medication_id, finding, version):
+    return InteractionAlert(user_id=user_id, medication_id=medication_id, other_medication_id=finding["other_id"],
+                            kind=finding["kind"], severity=finding["severity"], message=finding["message"],
+                            dataset_version=version)
+
+def delete_interaction_alerts(user_id, medication_ids):
+    """Drop alerts on either side of a pair once one of the medications is gone or inactive"""
+    return InteractionAlert.query.filter(InteractionAlert.user_id == user_id, db.or_(
+        InteractionAlert.medication_id.in_(medication_ids),
+        InteractionAlert.other_medication_id.in_(medication_ids))).delete(synchronize_session=False)
+
+def rescan_interactions(batch_size=500):
+    """Re-check every user's active medications, e.g. after a dataset update"""
+    index = interaction_index()
+    last_id, users, alerts = 0, 0, 0
+    while True:
+        user_ids = [u.id for u in User.query.filter(User.id > last_id).order_by(User.id.asc()).limit(batch_size).all()]
+        if not user_ids:
+            break
+        for uid in user_ids:
+            prof = Profile.query.filter_by(user_id=uid).first()
+            allergies = interactions.split_free_text(prof.allergies) if prof else []
+            profile_meds = interactions.split_free_text(prof.medications) if prof else []
+            meds = Medication.query.filter_by(user_id=uid, active=True).order_by(Medication.id.asc()).all()
+            InteractionAlert.query.filter_by(user_id=uid).delete()
+            # Each pair is checked once: every medication against those entered before it
+            for i, med in enumerate(meds):
+                for f in check_against(index, med.name, meds[:i], profile_meds, allergies):
+                    db.session.add(new_interaction_alert(uid, med.id, f, index.version))
+                    alerts += 1
+            users += 1
+        db.session.commit()
+        last_id = user_ids[-1]
+    return users, alerts
+
+@app.cli.command("rescan-interactions")
+def rescan_interactions_command():
+    """Re-scan all users against the current interaction dataset"""
+    users, alerts = rescan_interactions()
+    print(f"Rescanned {users} users, {alerts} interaction alerts (dataset {interaction_index().version})")
+
+# Retention: move old rows out of the hot tables into compressed archive chunks
+def row_to_dict(obj):
+    data = {}
+    for col in obj.__table__.columns:
+        value = getattr(obj, col.name)
+        data[col.name] = value.isoformat() if hasattr(value, "isoformat") else value
+    return data
+
+def load_archived(user_id, kind):
+    rows = []
+    for chunk in ArchiveChunk.query.filter_by(user_id=user_id, kind=kind).order_by(ArchiveChunk.id.asc()).all():
+        rows.extend(json.loads(zlib.decompress(chunk.payload)))
+    return rows
+
+def retention_candidates(kind, now):
+    """Query for rows of one kind that are due for archiving"""
+    if kind == "reminder":
+        cutoff = now - timedelta(days=app.config["RETENTION_REMINDER_DAYS"])
+        return Reminder.query.filter(db.or_(Reminder.sent_at < cutoff, db.and_(Reminder.sent_at.is_(None), Reminder.due_at < cutoff)))
+    if kind == "medication":
+        cutoff = now - timedelta(days=app.config["RETENTION_MEDICATION_DAYS"])
+        return Medication.query.filter(Medication.active == False, db.or_(
+            Medication.end_date < cutoff.date(), db.and_(Medication.end_date.is_(None), Medication.created_at < cutoff)))
+    if kind == "plan":
+        cutoff = now - timedelta(days=app.config["RETENTION_PLAN_DAYS"])
+        newer = aliased(Plan)
+        return Plan.query.filter(Plan.created_at < cutoff, exists().where(
+            newer.user_id == Plan.user_id, newer.kind == Plan.kind, newer.created_at > Plan.created_at))
+    raise ValueError(f"Unknown archive kind: {kind}")
+
+ARCHIVE_MODELS = {"reminder": Reminder, "medication": Medication, "plan": Plan}
+
+def archive_old_rows(batch_size=None, max_batches=None, pause=0.05):
+    """Archive rows in short transactions of at most batch_size rows each"""
+    batch_size = batch_size or app.config["RETENTION_BATCH_SIZE"]
+    now = datetime.utcnow()
+    moved = {kind: 0 for kind in ARCHIVE_MODELS}
+    batches = 0
+    # Ids are per shard, so each shard is paged separately
+    for shard_id in shard_ids_or_none():
+        for kind, model in ARCHIVE_MODELS.items():
+            last_id = 0
+            while max_batches is None or batches < max_batches:
+                query = retention_candidates(kind, now).filter(model.id > last_id).order_by(model.id.asc()).limit(batch_size)
+                rows = sharding.on_shard(query, shard_id).all()
+                if not rows:
+                    break
+                by_user = {}
+                for row in rows:
+                    by_user.setdefault(row.user_id, []).append(row_to_dict(row))
+                for uid, dicts in by_user.items():
+                    payload = zlib.compress(json.dumps(dicts, separators=(",", ":")).encode("utf-8"), 6)
+                    db.session.add(ArchiveChunk(user_id=uid, kind=kind, row_count=len(dicts), payload=payload))
+                if kind == "medication":
+                    ids = [r.id for r in rows]
+                    alerts = InteractionAlert.query.filter(db.or_(InteractionAlert.medication_id.in_(ids),
+                                                                  InteractionAlert.other_medication_id.in_(ids)))
+                    sharding.on_shard(alerts, shard_id).delete(synchronize_session=False)
+                for row in rows:
+                    db.session.delete(row)  # ORM delete so the search index follows
+                db.session.commit()
+                moved[kind] += len(rows)
+                last_id = rows[-1].id
+                batches += 1
+                if pause:
+                    time.sleep(pause)  # let request traffic take the write lock between batches
+    return moved
+
+def run_retention_job():
+    with app.app_context():
+        moved = archive_old_rows()
+        print(f"Retention job archived: {moved}")
+
+@app.cli.command("archive-old-rows")
+def archive_old_rows_command():
+    """Move sent reminders, old inactive medications and superseded plans to the archive"""
+    print(f"Archived: {archive_old_rows()}")
+
+# Shard admin: stats, moving users and rebalancing
+SHARD_REMAP = {("interaction_alert", "medication_id"): "medication",
+               ("interaction_alert", "other_medication_id"): "medication"}
+
+def require_sharding():
+    if not SHARD_IDS:
+        raise click.ClickException("Sharding is off; set SHARD_DATABASE_URLS")
+
+def move_user_to_shard(user_id, target):
+    """Move one user's rows to target while the app keeps serving; returns rows moved"""
+    source = shard_router.shard_for_user(user_id)
+    if source == target:
+        return 0
+    id_maps = sharding.move_user(db.engines[source], db.engines[target], target, [m.__table__ for m in SHARDED_MODELS],
+                                 user_id, lambda uid: set_user_shard(uid, target), remap=SHARD_REMAP)
+    # Re-point the search index at the new ids
+    src_conn, dst_conn = shard_connection(source), shard_connection(target)
+    ensure_search_schema(src_conn)
+    ensure_search_schema(dst_conn)
+    for model, doc_type in ((Medication, "medication"), (Reminder, "reminder"), (Plan, "plan"), (Profile, "profile")):
+        pairs = id_maps.get(model.__tablename__, [])
+        if not pairs:
+            continue
+        for old_id, _ in pairs:
+            search.delete_document(src_conn, doc_type, old_id, user_id)
+        moved = sharding.on_shard(model.query.filter(model.id.in_([new for _, new in pairs])), target).all()
+        for obj in moved:
+            _, title, body = search_document_for(obj)
+            search.upsert_document(dst_conn, doc_type, obj.id, obj.user_id, title, body)
+    db.session.commit()
+    return sum(len(pairs) for pairs in id_maps.values())
+
+def rebalance_shards(max_moves=50, tolerance=0.1, dry_run=False):
+    """Greedily move users from the heaviest shard to the lightest until loads are within tolerance"""
+    tables = [m.__table__ for m in SHARDED_MODELS]
+    loads = {sid: sharding.user_loads(db.engines[sid], tables) for sid in SHARD_IDS}
+    moves = []
+    while len(moves) < max_moves:
+        totals = {sid: sum(users.values()) for sid, users in loads.items()}
+        heavy, light = max(totals, key=totals.get), min(totals, key=totals.get)
+        gap = totals[heavy] - totals[light]
+        if gap <= tolerance * max(1, sum(totals.values()) / len(totals)):
+            break
+        # Biggest user that still narrows the gap
+        fits = [(rows, uid) for uid, rows in loads[heavy].items() if rows < gap]
+        if not fits:
+            break
+        rows, uid = max(fits)
+        moves.append((uid, heavy, light, rows))
+        loads[light][uid] = loads[heavy].pop(uid)
+    if not dry_run:
+        for uid, _, target, _ in moves:
+            move_user_to_shard(uid, target)
+    return moves
+
+@app.cli.command("shard-stats")
+def shard_stats_command():
+    """Row counts per shard and table"""
+    require_sharding()
+    print(f"primary: {User.query.count()} users, {UserShard.query.count()} moved")
+    for sid in SHARD_IDS:
+        counts = {m.__tablename__: sharding.on_shard(m.query, sid).count() for m in SHARDED_MODELS}
+        print(f"{sid}: " + ", ".join(f"{name}={n}" for name, n in counts.items()))
+
+@app.cli.command("move-user")
+@click.argument("user_id", type=int)
+@click.argument("shard_id")
+def move_user_command(user_id, shard_id):
+    """Move a user's rows to another shard"""
+    require_sharding()
+    if shard_id not in SHARD_IDS:
+        raise click.ClickException(f"Unknown shard {shard_id}; have {', '.join(SHARD_IDS)}")
+    print(f"Moved {move_user_to_shard(user_id, shard_id)} rows for user {user_id} to {shard_id}")
+
+@app.cli.command("rebalance-shards")
+@click.option("--max-moves", default=50, show_default=True)
+@click.option("--dry-run", is_flag=True)
+def rebalance_shards_command(max_moves, dry_run):
+    """Move users off the heaviest shards"""
+    require_sharding()
+    for uid, source, target, rows in rebalance_shards(max_moves=max_moves, dry_run=dry_run):
+        print(f"{'Would move' if dry_run else 'Moved'} user {uid} ({rows} rows) {source} -> {target}")
+
+# Backups: a full snapshot of every database, then incrementals on top of it
+def backup_targets():
+    """(name, engine, tables in dependency order) for the primary and each shard"""
+    targets = [("primary", db.engines[None], list(db.metadata.sorted_tables))]
+    for sid in SHARD_IDS:
+        targets.append((sid, db.engines[sid], [m.__table__ for m in SHARDED_MODELS]))
+    return targets
+
+def take_snapshots(full=False):
+    """Snapshot every database; incremental with BACKUP_INCREMENTAL unless full or there is no chain yet"""
+    directory = app.config["BACKUP_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    results = []
+    for name, engine, tables in backup_targets():
+        last = backup.chain(directory, name)
+        incremental = app.config["BACKUP_INCREMENTAL"]
+        kind = "full" if full or not incremental or not last or not last[0][1].get("tracked", True) else "incremental"
+        if kind == "incremental" and engine.dialect.name == "postgresql" and not last[-1][1].get("pg_snapshot"):
+            kind = "full"  # a chain from before snapshots recorded pg_snapshot can't be continued safely
+        path = os.path.join(directory, backup.snapshot_name(name, kind))
+        if kind == "full":
+            rows, header = backup.snapshot_full(engine, tables, path, name=name, track=incremental)
+        else:
+            previous = last[-1][1]
+            rows, header = backup.snapshot_incremental(engine, tables, path, previous["seq"], name=name,
+                                                       since_snapshot=previous.get("pg_snapshot"))
+        if incremental:
+            backup.prune_changes(engine, header["seq"], header.get("pg_snapshot"))
+        backup.prune_snapshots(directory, name, app.config["BACKUP_KEEP_FULL"])
+        results.append((path, kind, rows))
+    return results
+
+def restore_snapshots(until=None):
+    """Replace every database with its newest chain (up to until); returns rows restored"""
+    directory = app.config["BACKUP_DIR"]
+    chains = [(name, engine, tables, [p for p, _ in backup.chain(directory, name, until)])
+              for name, engine, tables in backup_targets()]
+    missing = [name for name, _, _, paths in chains if not paths]
+    if missing:
+        raise backup.SnapshotError(f"No full snapshot for {', '.join(missing)} in {directory}")
+    db.session.remove()
+    total = 0
+    for name, engine, tables, paths in chains:
+        total += backup.restore_full(engine, tables, paths)
+        _search_schema_ready.discard(str(engine.url))
+        if name in SHARD_IDS:
+            sharding.create_shard_tables(engine, tables)
+    # The search index is derived data; rebuild it from the restored rows
+    for engine in data_engines():
+        with engine.begin() as conn:
+            ensure_search_schema(conn)
+            search.delete_user_documents(conn)
+    rebuild_search_index()
+    # Change numbers restart with the restored data, so the old chains end here
+    take_snapshots(full=True)
+    return total
+
+def restore_user_snapshot(user_id, until=None):
+    """Put one user's rows back as they were in the newest snapshot (up to until)
+
+    The user may have moved shards since, so every chain is searched; when
+    several have rows for them, the most recent one wins. Refuses, leaving
+    the live rows alone, when no snapshot has any.
+    """
+    tables = [m.__table__ for m in SHARDED_MODELS]
+    found = []
+    for name in SHARD_IDS or ["primary"]:
+        snapshots = backup.chain(app.config["BACKUP_DIR"], name, until)
+        if snapshots:
+            state = backup.user_rows([p for p, _ in snapshots], tables, user_id)
+            if any(state.values()):
+                found.append((snapshots[-1][1]["created_at"], state))
+    if not found:
+        raise backup.SnapshotError(f"No snapshot has rows for user {user_id}")
+    state = max(found, key=lambda f: f[0])[1]
+    conn = user_connection(user_id)
+    counts = backup.restore_user(conn, tables, state, user_id, remap=SHARD_REMAP)
+    ensure_search_schema(conn)
+    search.delete_user_documents(conn, user_id)
+    for model in (Medication, Reminder, Plan, Profile):
+        search.upsert_documents(conn, [(doc_type, obj.id, obj.user_id, title, body)
+                                       for obj in model.query.filter_by(user_id=user_id).all()
+                                       for doc_type, title, body in [search_document_for(obj)]])
+    db.session.commit()
+    return counts
+
+BACKUP_RETRY_MINUTES = 5
+
+def run_backup_job(full=False):
+    with app.app_context():
+        try:
+            for path, kind, rows in take_snapshots(full=full):
+                print(f"Backup: {kind} snapshot {path} ({rows} rows)")
+        except backup.SnapshotError as e:
+            print(f"Backup failed, retrying in {BACKUP_RETRY_MINUTES} minutes: {e}")
+            scheduler.add_job(run_backup_job, "date", run_date=datetime.utcnow() + timedelta(minutes=BACKUP_RETRY_MINUTES),
+                              kwargs={"full": full}, id="backup-retry", replace_existing=True)
+
+@app.cli.command("snapshot")
+@click.option("--full", is_flag=True, help="Start a new chain instead of adding an incremental")
+def snapshot_command(full):
+    """Back up every database without blocking the app"""
+    try:
+        for path, kind, rows in take_snapshots(full=full):
+            print(f"{kind}: {path} ({rows} rows, {os.path.getsize(path):,} bytes)")
+    except backup.SnapshotError as e:
+        raise click.ClickException(str(e))
+
+@app.cli.command("list-snapshots")
+@click.option("--verify", is_flag=True, help="Read every file and check its checksums")
+def list_snapshots_command(verify):
+    """Show the snapshots in BACKUP_DIR"""
+    for name, _, _ in backup_targets():
+        for path in backup.list_snapshots(app.config["BACKUP_DIR"], name):
+            header = backup.read_header(path)
+            status = ""
+            if verify:
+                try:
+                    status = f"  ok, {backup.verify(path)[1]} rows"
+                except backup.SnapshotError as e:
+                    status = f"  BAD: {e}"
+            print(f"{os.path.basename(path)}  seq {header['seq']}  {os.path.getsize(path):,} bytes{status}")
+
+@app.cli.command("restore-snapshot")
+@click.option("--at", "until", help="Timestamp prefix, e.g. 20261019T0930; default is the newest snapshot")
+@click.confirmation_option(prompt="This replaces the contents of every database. Continue?")
+def restore_snapshot_command(until):
+    """Restore every database from its snapshot chain"""
+    try:
+        print(f"Restored {restore_snapshots(until)} rows")
+    except backup.SnapshotError as e:
+        raise click.ClickException(str(e))
+
+@app.cli.command("restore-user")
+@click.argument("user_id", type=int)
+@click.option("--at", "until", help="Timestamp prefix, e.g. 20261019T0930; default is the newest snapshot")
+def restore_user_command(user_id, until):
+    """Restore one user's profile, reminders, medications, plans and billing rows"""
+    try:
+        counts = restore_user_snapshot(user_id, until)
+    except backup.SnapshotError as e:
+        raise click.ClickException(str(e))
+    print(", ".join(f"{name}={n}" for name, n in counts.items()))
+
+scheduler = BackgroundScheduler(timezone="UTC")
+
+def start_scheduler():
+    scheduler.add_job(run_retention_job, "cron", hour=3, minute=30, id="retention",
+                      replace_existing=True, max_instances=1, coalesce=True)
+    if app.config["BACKUP_INTERVAL_MINUTES"]:
+        scheduler.add_job(run_backup_job, "cron", hour=2, minute=0, kwargs={"full": True}, id="backup-full",
+                          replace_existing=True, max_instances=1, coalesce=True)
+        scheduler.add_job(run_backup_job, "interval", minutes=app.config["BACKUP_INTERVAL_MINUTES"], id="backup",
+                          replace_existing=True, max_instances=1, coalesce=True)
+    scheduler.start()
+
+# Every gunicorn worker imports this module, but only one may run the scheduled jobs
+SCHEDULER_LOCK_KEY = 0x56470001
+_scheduler_lock = None
+
+def acquire_scheduler_lock():
+    """Take the scheduler lock without waiting: a Postgres advisory lock, else a lock file in instance/"""
+    global _scheduler_lock
+    if _scheduler_lock is not None:
+        return True
+    with app.app_context():
+        engine = db.engines[None]
+    if engine.dialect.name == "postgresql":
+        # Held by this session until the process (and so the connection) goes away
+        conn = engine.connect()
+        if conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": SCHEDULER_LOCK_KEY}).scalar():
+            conn.commit()
+            _scheduler_lock = conn
+            return True
+        conn.close()
+        return False
+    try:
+        import fcntl
+    except ImportError:
+        _scheduler_lock = True  # no flock on Windows; the dev server is a single process anyway
+        return True
+    os.makedirs(app.instance_path, exist_ok=True)
+    f = open(os.path.join(app.instance_path, "scheduler.lock"), "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _scheduler_lock = f
+    return True
+
+def start_scheduler_if_leader(retry_seconds=60):
+    """Start the scheduler in the process holding the lock; the others retry in case it exits"""
+    if acquire_scheduler_lock():
+        print(f"Scheduler running in process {os.getpid()}")
+        start_scheduler()
+        return
+    retry = threading.Timer(retry_seconds, start_scheduler_if_leader, kwargs={"retry_seconds": retry_seconds})
+    retry.daemon = True
+    retry.start()
+
+# Live reminder push: one hub per process, fed by one dispatcher thread
+push_hub = push.ReminderHub()
+_push_state = {"last_tick": None, "refills_sent": {}}  # refills_sent: user_id -> date refill alerts last went out
+
+def refill_events(user_ids, today):
+    """(user_id, data) for active medications whose refill is due within a week or overdue"""
+    soon = today + timedelta(days=7)
+    meds = Medication.query.filter(Medication.user_id.in_(user_ids), Medication.active == True,
+                                   Medication.refill_date <= soon).all()
+    events = []
+    for m in meds:
+        days_until = (m.refill_date - today).days
+        message = f"{m.name} refill overdue by {-days_until} days" if days_until < 0 else f"{m.name} refill needed in {days_until} days"
+        events.append((m.user_id, {"id": m.id, "name": m.name, "days_until": days_until, "message": message}))
+    return events
+
+def push_due_reminders(hub, now=None):
+    """Publish reminders whose due or pre-notify time passed since the last tick"""
+    with app.app_context():
+        now = now or datetime.utcnow()
+        last = _push_state["last_tick"] or now - timedelta(seconds=app.config["PUSH_INTERVAL_SECONDS"])
+        _push_state["last_tick"] = now
+        lookahead = now + timedelta(days=app.config["PUSH_LOOKAHEAD_DAYS"])
+        users = hub.connected_users()
+        # Streams get their refills on connect; users still connected at a new day get them again
+        sent, connected = _push_state["refills_sent"], set(users)
+        for uid in list(sent):
+            if uid not in connected:
+                del sent[uid]
+        for i in range(0, len(users), 500):
+            chunk = users[i:i + 500]
+            rems = Reminder.query.filter(Reminder.user_id.in_(chunk), Reminder.due_at > last, Reminder.due_at <= lookahead).all()
+            for r in rems:
+                due = r.due_at.isoformat() + "Z"
+                notify_at = r.due_at - timedelta(minutes=r.pre_notify_min or 0)
+                if r.pre_notify_min and last < notify_at <= now:
+                    hub.publish(r.user_id, "pre_notify", {"id": r.id, "title": r.title, "kind": r.kind, "due_at": due,
+                                                          "message": f"{r.title} in {r.pre_notify_min} min"})
+                if r.due_at <= now:
+                    hub.publish(r.user_id, "due", {"id": r.id, "title": r.title, "kind": r.kind, "due_at": due,
+                                                   "message": f"{r.title} is due now"})
+            stale = [uid for uid in chunk if sent.get(uid) != now.date()]
+            if stale:
+                for uid, data in refill_events(stale, now.date()):
+                    hub.publish(uid, "refill", data)
+                for uid in stale:
+                    sent[uid] = now.date()
+
+@app.route("/reminders/stream")
+@login_required
+def reminder_stream():
+    user_id = current_user.id
+    keepalive = app.config["PUSH_KEEPALIVE_SECONDS"]
+    push_hub.ensure_dispatcher(push_due_reminders, app.config["PUSH_INTERVAL_SECONDS"])
+    today = datetime.utcnow().date()
+    refills = [data for _, data in refill_events([user_id], today)]
+
+    def events():
+        sub = push_hub.subscribe(user_id)
+        try:
+            _push_state["refills_sent"][user_id] = today
+            for data in refills:
+                push_hub.send(sub, "refill", data)
+            yield "retry: 5000\n\n"
+            while True:
+                yield sub.get(keepalive) or ": keepalive\n\n"
+        finally:
+            push_hub.unsubscribe(sub)
+
+    # The generator holds no request context or DB session while it waits
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/push/stats")
+@login_required
+def push_stats():
+    if not is_operator(current_user):
+        return jsonify({"error": "Operators only"}), 403
+    return jsonify(push_hub.stats())
+
 # AI Functions
 def call_openai_api(symptoms, profile_context):
     if not USE_OPENAI or not client:
@@ -263,7 +1003,8 @@ Safety: If emergency symptoms (chest pain, breathing issues, bleeding), set urge
             ],
             temperature=0.3,
             max_tokens=800,
-            response_format={"type": "json_object"}
+            response_format={"type": "json_object"},
+            timeout=OPENAI_DEADLINE_SECONDS
         )
         
         result_text = response.choices[0].message.content.strip()
@@ -282,8 +1023,9 @@ Safety: If emergency symptoms (chest pain, breathing issues, bleeding), set urge
         return result
         
     except Exception as e:
+        # analyze_symptoms counts this against the circuit breaker
         print(f"OpenAI error: {e}")
-        return None
+        raise
 
 def fallback_analysis(symptoms):
     symptoms = symptoms.lower()
@@ -316,6 +1058,57 @@ def fallback_analysis(symptoms):
             "disclaimer": "Educational information only"
         }
 
+# OpenAI guard: deadline, circuit breaker and a speculative rule-based answer
+ai_breaker = circuit.CircuitBreaker(failure_threshold=int(os.getenv("OPENAI_BREAKER_FAILURES", 5)),
+                                    reset_seconds=float(os.getenv("OPENAI_BREAKER_RESET_SECONDS", 30)))
+ai_stats = circuit.LatencyStats()
+ai_executor = ThreadPoolExecutor(max_workers=int(os.getenv("OPENAI_MAX_CONCURRENCY", 8)), thread_name_prefix="openai")
+
+def analyze_symptoms(symptoms, profile_context):
+    """Return OpenAI's analysis if it arrives in time, otherwise the rule-based one"""
+    # Computed up front so falling back at the deadline costs nothing
+    speculative = dict(fallback_analysis(symptoms), source="rules")
+    if not USE_OPENAI or not client:
+        return speculative
+    if not ai_breaker.allow():
+        ai_stats.record("short_circuit")
+        return speculative
+
+    started = time.monotonic()
+    future = ai_executor.submit(call_openai_api, symptoms, profile_context)
+    try:
+        result = future.result(timeout=max(0.0, OPENAI_DEADLINE_SECONDS - OPENAI_HEDGE_MARGIN_SECONDS))
+    except FutureTimeout:
+        # Deadline is near: answer now. A call still queued behind busy workers is
+        # dropped so it never reaches a struggling upstream; one already running finishes
+        ai_breaker.record_failure()
+        ai_stats.record("hedged")
+        if future.cancel():
+            ai_stats.record("cancelled")
+        else:
+            future.add_done_callback(lambda f: ai_stats.record("late", time.monotonic() - started))
+        return dict(speculative, hedged=True)
+    except Exception:
+        ai_breaker.record_failure()
+        ai_stats.record("error", time.monotonic() - started)
+        return speculative
+
+    ai_breaker.record_success()
+    ai_stats.record("success", time.monotonic() - started)
+    return dict(result, source="openai")
+
+@app.route("/api/ai/status")
+@login_required
+def ai_status():
+    if not is_operator(current_user):
+        return jsonify({"error": "Operators only"}), 403
+    return jsonify({
+        "enabled": USE_OPENAI,
+        "deadline_seconds": OPENAI_DEADLINE_SECONDS,
+        "breaker": ai_breaker.snapshot(),
+        **ai_stats.snapshot(),
+    })
+
 # Make user_has_active_subscription available in templates
 @app.context_processor
 def inject_user_functions():
@@ -499,12 +1292,22 @@ def medications():
             pills_remaining=pills_count,
             notes=notes
         )
+        findings = check_new_medication(current_user.id, name)
         db.session.add(med)
         db.session.commit()
+        for f in findings:
+            db.session.add(new_interaction_alert(current_user.id, med.id, f, interaction_index().version))
+            flash(f["message"], "warning")
+        db.session.commit()
         flash("Medication added successfully.","success")
         return redirect(url_for("medications"))
         
     meds = Medication.query.filter_by(user_id=current_user.id, active=True).order_by(Medication.name.asc()).all()
+    active_ids = [m.id for m in meds]
+    interaction_alerts = InteractionAlert.query.filter(
+        InteractionAlert.user_id == current_user.id, InteractionAlert.medication_id.in_(active_ids),
+        db.or_(InteractionAlert.other_medication_id.is_(None), InteractionAlert.other_medication_id.in_(active_ids))
+    ).order_by(InteractionAlert.created_at.desc()).all()
     
     today = datetime.now().date()
     refill_alerts = []
@@ -517,7 +1320,7 @@ def medications():
                 "is_overdue": days_until < 0
             })
     
-    return render_template("medications.html", medications=meds, refill_alerts=refill_alerts)
+    return render_template("medications.html", medications=meds, refill_alerts=refill_alerts, interaction_alerts=interaction_alerts)
 
 @app.route("/medications/<int:mid>/toggle", methods=["POST"])
 @login_required
@@ -525,6 +1328,11 @@ def toggle_medication(mid):
     med = Medication.query.filter_by(id=mid, user_id=current_user.id).first_or_404()
     med.active = not med.active
     db.session.add(med)
+    delete_interaction_alerts(current_user.id, [med.id])
+    if med.active:
+        for f in check_new_medication(current_user.id, med.name, exclude_id=med.id):
+            db.session.add(new_interaction_alert(current_user.id, med.id, f, interaction_index().version))
+            flash(f["message"], "warning")
     db.session.commit()
     status = "activated" if med.active else "deactivated"
     flash(f"Medication {status}.","success")
@@ -534,6 +1342,7 @@ def toggle_medication(mid):
 @login_required
 def delete_medication(mid):
     med = Medication.query.filter_by(id=mid, user_id=current_user.id).first_or_404()
+    delete_interaction_alerts(current_user.id, [med.id])
     db.session.delete(med)
     db.session.commit()
     flash("Medication deleted.","success")
@@ -545,6 +1354,32 @@ def assistant():
     has_pro = user_has_active_subscription(current_user)
     return render_template("assistant.html", ai_enabled=USE_OPENAI, has_pro=has_pro)
 
+@app.route("/doctors")
+@login_required
+def doctors():
+    directory = providers.get_directory(app.config["PROVIDERS_DATASET"])
+    specialty = providers.normalize_specialty(request.args.get("specialty", ""))
+    if specialty not in directory.by_specialty:
+        specialty = ""
+    return render_template("doctors.html", specialty=specialty, specialties=directory.specialties)
+
+@app.route("/api/providers")
+@login_required
+def providers_api():
+    try:
+        lat = float(request.args.get("lat", ""))
+        lon = float(request.args.get("lon", ""))
+    except ValueError:
+        return jsonify({"error": "lat and lon are required"}), 400
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({"error": "lat/lon out of range"}), 400
+    n = min(max(request.args.get("n", 10, type=int), 1), 50)
+    max_km = request.args.get("max_km", type=float)
+    directory = providers.get_directory(app.config["PROVIDERS_DATASET"])
+    results = directory.nearest(lat, lon, n=n, specialty=request.args.get("specialty") or None,
+                                accepting_only=request.args.get("accepting") == "1", max_km=max_km)
+    return jsonify({"providers": results, "count": len(results)})
+
 @app.route("/billing")
 @login_required
 def billing():
@@ -702,15 +1537,10 @@ def health_assistant_api():
         print(f"User profile: {profile_context}")
         print(f"OpenAI enabled: {USE_OPENAI}")
         
-        result = None
-        if USE_OPENAI:
-            print("Trying OpenAI...")
-            result = call_openai_api(symptoms, profile_context)
-        
-        if not result:
-            print("Using fallback analysis")
-            result = fallback_analysis(symptoms)
+        result = analyze_symptoms(symptoms, profile_context)
+        print(f"Analysis source: {result['source']}")
         
+        result["directory_link"] = url_for("doctors", specialty=result.get("suggested_specialty", ""))
         if result.get("doctor_search_query"):
             from urllib.parse import quote_plus
             query = quote_plus(result["doctor_search_query"])
@@ -723,6 +1553,36 @@ def health_assistant_api():
         print(f"API Error: {e}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+def search_results(q, doc_type=None):
+    if doc_type not in search.DOC_TYPES:
+        doc_type = None
+    conn = user_connection(current_user.id)
+    ensure_search_schema(conn)
+    results = search.search(conn, current_user.id, q, limit=50, doc_type=doc_type)
+    urls = {"medication": url_for("medications"), "reminder": url_for("reminders"), "plan": url_for("assistant"), "profile": url_for("profile")}
+    for r in results:
+        r["url"] = urls[r["doc_type"]]
+        r["snippet_html"] = str(Markup(escape(r["snippet"] or "")).replace(search.HL_START, Markup("<mark>")).replace(search.HL_END, Markup("</mark>")))
+        r["snippet"] = (r["snippet"] or "").replace(search.HL_START, "").replace(search.HL_END, "")
+    return results
+
+@app.route("/search")
+@login_required
+def search_page():
+    q = request.args.get("q", "").strip()
+    doc_type = request.args.get("type")
+    results = search_results(q, doc_type) if q else []
+    return render_template("search.html", q=q, doc_type=doc_type, results=results)
+
+@app.route("/api/search")
+@login_required
+def search_api():
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify({"error": "Query parameter q is required"}), 400
+    results = search_results(q, request.args.get("type"))
+    return jsonify({"query": q, "results": [{k: r[k] for k in ("doc_type", "doc_id", "title", "snippet", "score", "url")} for r in results]})
+
 @app.route("/export")
 @login_required  
 def export():
@@ -732,6 +1592,7 @@ def export():
         meds = Medication.query.filter_by(user_id=current_user.id).all()
     except:
         meds = []
+    plans = Plan.query.filter_by(user_id=current_user.id).order_by(Plan.created_at.asc()).all()
         
     data = {
         "user": {"email": current_user.email, "is_pro": user_has_active_subscription(current_user)},
@@ -742,8 +1603,13 @@ def export():
             "family_history": getattr(prof, 'family_history', '') if prof else "",
         },
         "reminders": [{"title": r.title, "due_at": r.due_at.isoformat()} for r in rems],
-        "medications": [{"name": m.name, "dosage": m.dosage, "active": m.active} for m in meds]
+        "medications": [{"name": m.name, "dosage": m.dosage, "active": m.active} for m in meds],
+        "plans": [{"kind": p.kind, "created_at": p.created_at.isoformat(), "content": p.content} for p in plans]
     }
+    # Rows moved out by the retention job are exported from the archive
+    data["reminders"] += [{"title": r["title"], "due_at": r["due_at"], "archived": True} for r in load_archived(current_user.id, "reminder")]
+    data["medications"] += [{"name": m["name"], "dosage": m["dosage"], "active": m["active"], "archived": True} for m in load_archived(current_user.id, "medication")]
+    data["plans"] += [{"kind": p["kind"], "created_at": p["created_at"], "content": p["content"], "archived": True} for p in load_archived(current_user.id, "plan")]
     return Response(json.dumps(data, indent=2), mimetype="application/json")
 
 # SEO Routes
@@ -760,6 +1626,7 @@ def robots():
         "Disallow: /medications\n" 
         "Disallow: /reminders\n"
         "Disallow: /export\n"
+        "Disallow: /search\n"
         f"Sitemap: {request.url_root}sitemap.xml\n",
         mimetype='text/plain'
     )
@@ -769,4 +1636,10 @@ if __name__ == "__main__":
     bootstrap_db()
     port = int(os.environ.get('PORT', 5000))
     debug_mode = os.environ.get('FLASK_ENV') != 'production'
-    app.run(host="0.0.0.0", port=port, debug=debug_mode)
\ No newline at end of file
+    # With the debug reloader only the child process serves requests
+    if not debug_mode or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_scheduler_if_leader()
+    app.run(host="0.0.0.0", port=port, debug=debug_mode)
+elif os.getenv("RUN_SCHEDULER") == "1":
+    # Safe in every gunicorn worker: they elect one scheduler through the lock
+    start_scheduler_if_leader()
\ No newline at end of file
@@ -0,0 +1,763 @@
+"""Online snapshots of the app's databases and restores from them.
+
+A snapshot file holds a JSON header followed by zlib-compressed frames of
+rows (or deleted ids) for one table each. Every frame carries a CRC32 of
+its rows and the file ends with a SHA-256 of everything before it, so a
+truncated or corrupted file is rejected instead of half-restored.
+
+Full snapshots of SQLite are read from a copy taken with the online backup
+API. In WAL mode (the app's default) that copy reads a snapshot and blocks
+nobody; with a rollback journal it goes a few pages at a time so writers
+get the lock between steps, and gives up rather than lock them out.
+Postgres is dumped with COPY inside a REPEATABLE READ transaction, which
+blocks nobody; the COPY output is parsed and written out as it streams in,
+one batch of rows at a time.
+
+Incremental snapshots rely on change tracking, which a full snapshot
+installs when it starts a chain (and removes when it doesn't, so nothing
+grows unpruned): triggers append (table, row id) to row_change on every
+insert, update and delete, including bulk and Core-level writes that ORM
+events would miss. An incremental holds the current rows for ids changed
+since the previous snapshot's sequence number, and the ids that no longer
+exist as deletes. On Postgres each change also records its transaction id,
+and "since the previous snapshot" means "not visible to it" (pg_snapshot in
+the header, Postgres 13 or later), because change ids are handed out before
+the writing transaction commits. A chain is one full snapshot plus the
+incrementals after it, restored in order.
+"""
+import os, io, re, json, zlib, time, struct, sqlite3, hashlib, tempfile
+from datetime import datetime, date
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, LargeBinary, select, text, inspect as sa_inspect
+from sqlalchemy.dialects import sqlite as sqlite_dialect
+from sqlalchemy.schema import CreateTable, CreateIndex
+
+MAGIC = b"VGSNAP1\n"
+SUFFIX = ".vgsnap"
+FRAME_ROWS, FRAME_DELETES, FRAME_END = b"R", b"D", b"E"
+FRAME_HEAD = struct.Struct(">HIIII")  # table index, row count, raw length, compressed length, crc32
+CHANGE_TABLE = "row_change"
+BATCH_ROWS = 5000
+COMPRESS_LEVEL = 6
+STEP_PAGES = 1024
+STEP_PAUSE = 0.005
+MAX_RESTARTS = 3
+
+
+class SnapshotError(Exception):
+    pass
+
+
+# Change tracking
+
+def _pk(table):
+    return list(table.primary_key.columns)[0].name
+
+
+def _q(name):
+    return f'"{name}"'
+
+
+def _existing(engine, tables):
+    """[(table, column names)] for the tables and columns that exist in the database."""
+    inspector = sa_inspect(engine)
+    names = set(inspector.get_table_names())
+    out = []
+    for t in tables:
+        if t.name in names:
+            have = {c["name"] for c in inspector.get_columns(t.name)}
+            out.append((t, [c.name for c in t.columns if c.name in have]))
+    return out
+
+
+def tracking_ddl(dialect, tables):
+    if dialect == "postgresql":
+        stmts = [
+            f"CREATE TABLE IF NOT EXISTS {CHANGE_TABLE} (id BIGSERIAL PRIMARY KEY, tbl TEXT NOT NULL, row_id BIGINT NOT NULL, "
+            "xid xid8 NOT NULL DEFAULT pg_current_xact_id())",
+            f"ALTER TABLE {CHANGE_TABLE} ADD COLUMN IF NOT EXISTS xid xid8 NOT NULL DEFAULT pg_current_xact_id()",
+            f"""CREATE OR REPLACE FUNCTION {CHANGE_TABLE}_log() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO {CHANGE_TABLE} (tbl, row_id) VALUES (TG_TABLE_NAME,
+                    ((CASE WHEN TG_OP = 'DELETE' THEN to_jsonb(OLD) ELSE to_jsonb(NEW) END) ->> TG_ARGV[0])::bigint);
+                RETURN NULL;
+            END $$ LANGUAGE plpgsql""",
+        ]
+        for t in tables:
+            stmts.append(f'DROP TRIGGER IF EXISTS {CHANGE_TABLE}_{t.name} ON "{t.name}"')
+            stmts.append(f'CREATE TRIGGER {CHANGE_TABLE}_{t.name} AFTER INSERT OR UPDATE OR DELETE ON "{t.name}" '
+                         f"FOR EACH ROW EXECUTE FUNCTION {CHANGE_TABLE}_log('{_pk(t)}')")
+        return stmts
+    stmts = [f"CREATE TABLE IF NOT EXISTS {CHANGE_TABLE} (id INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL, row_id INTEGER NOT NULL)"]
+    for t in tables:
+        for op, ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            stmts.append(f'CREATE TRIGGER IF NOT EXISTS {CHANGE_TABLE}_{t.name}_{op.lower()} AFTER {op} ON "{t.name}" '
+                         f"BEGIN INSERT INTO {CHANGE_TABLE} (tbl, row_id) VALUES ('{t.name}', {ref}.{_pk(t)}); END")
+    return stmts
+
+
+def install_tracking(engine, tables):
+    """Create row_change and its triggers if they are missing."""
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            have = set(conn.execute(text("SELECT tgname FROM pg_trigger WHERE tgname LIKE :p"), {"p": f"{CHANGE_TABLE}_%"}).scalars())
+            has_xid = conn.execute(text("SELECT 1 FROM information_schema.columns "
+                                        "WHERE table_name = :t AND column_name = 'xid'"), {"t": CHANGE_TABLE}).first()
+            if has_xid and all(f"{CHANGE_TABLE}_{t.name}" in have for t in tables):
+                return
+        for stmt in tracking_ddl(engine.dialect.name, tables):
+            conn.exec_driver_sql(stmt)
+
+
+def drop_tracking(engine, tables):
+    """Remove row_change and its triggers, for databases that only get full snapshots."""
+    if not sa_inspect(engine).has_table(CHANGE_TABLE):
+        return
+    with engine.begin() as conn:
+        for t in tables:
+            if engine.dialect.name == "postgresql":
+                conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS {CHANGE_TABLE}_{t.name} ON "{t.name}"')
+            else:
+                for op in ("insert", "update", "delete"):
+                    conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {CHANGE_TABLE}_{t.name}_{op}")
+        conn.exec_driver_sql(f"DROP TABLE {CHANGE_TABLE}")
+        if engine.dialect.name == "postgresql":
+            conn.exec_driver_sql(f"DROP FUNCTION IF EXISTS {CHANGE_TABLE}_log()")
+
+
+def prune_changes(engine, seq, pg_snapshot=None):
+    """Forget changes already captured by a snapshot up to seq.
+
+    On Postgres only changes visible to the snapshot (pg_snapshot, from its
+    header) go: a lower id may belong to a transaction that was still open.
+    """
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text(f"DELETE FROM {CHANGE_TABLE} WHERE id <= :seq "
+                              "AND pg_visible_in_snapshot(xid, CAST(:snap AS pg_snapshot))"),
+                         {"seq": seq, "snap": pg_snapshot})
+        else:
+            conn.execute(text(f"DELETE FROM {CHANGE_TABLE} WHERE id <= :seq"), {"seq": seq})
+
+
+# Snapshot files
+
+class SnapshotWriter:
+    def __init__(self, path, header):
+        self.path = path
+        self._tmp = path + ".partial"
+        self._f = open(self._tmp, "wb")
+        self._sha = hashlib.sha256()
+        head = json.dumps(header).encode("utf-8")
+        self._write(MAGIC + struct.pack(">I", len(head)) + head)
+        self.rows = 0
+
+    def _write(self, data):
+        self._sha.update(data)
+        self._f.write(data)
+
+    def _frame(self, kind, table_index, items):
+        raw = json.dumps(items, separators=(",", ":")).encode("utf-8")
+        comp = zlib.compress(raw, COMPRESS_LEVEL)
+        self._write(kind + FRAME_HEAD.pack(table_index, len(items), len(raw), len(comp), zlib.crc32(raw)) + comp)
+
+    def rows_frame(self, table_index, rows):
+        if rows:
+            self._frame(FRAME_ROWS, table_index, rows)
+            self.rows += len(rows)
+
+    def deletes_frame(self, table_index, ids):
+        if ids:
+            self._frame(FRAME_DELETES, table_index, ids)
+
+    def close(self):
+        self._f.write(FRAME_END + self._sha.digest())
+        self._f.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        self._f.close()
+        os.remove(self._tmp)
+
+
+def _parse_header(path, head, body):
+    if head[:len(MAGIC)] != MAGIC:
+        raise SnapshotError(f"{path} is not a snapshot")
+    try:
+        header = json.loads(body)
+        [t["name"] for t in header["tables"]]
+    except (ValueError, KeyError, TypeError):
+        raise SnapshotError(f"{path}: corrupt header")
+    return header
+
+
+def _read_head(f):
+    head = f.read(len(MAGIC) + 4)
+    try:
+        (length,) = struct.unpack(">I", head[len(MAGIC):])
+    except struct.error:
+        length = 0
+    return head, f.read(length)
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        return _parse_header(path, *_read_head(f))
+
+
+def read_frames(path):
+    """Yield (kind, table name, items) and check every checksum on the way."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        head, body = _read_head(f)
+        sha.update(head + body)
+        names = [t["name"] for t in _parse_header(path, head, body)["tables"]]
+        while True:
+            kind = f.read(1)
+            if kind == FRAME_END:
+                if f.read(32) != sha.digest():
+                    raise SnapshotError(f"{path}: file checksum mismatch")
+                return
+            if kind not in (FRAME_ROWS, FRAME_DELETES):
+                raise SnapshotError(f"{path}: truncated or corrupt")
+            meta = f.read(FRAME_HEAD.size)
+            comp = f.read(FRAME_HEAD.unpack(meta)[3]) if len(meta) == FRAME_HEAD.size else b""
+            sha.update(kind + meta + comp)
+            try:
+                index, count, raw_len, comp_len, crc = FRAME_HEAD.unpack(meta)
+                raw = zlib.decompress(comp)
+            except (struct.error, zlib.error):
+                raise SnapshotError(f"{path}: truncated or corrupt")
+            if len(raw) != raw_len or zlib.crc32(raw) != crc or index >= len(names):
+                raise SnapshotError(f"{path}: frame checksum mismatch")
+            yield kind, names[index], json.loads(raw)
+
+
+def verify(path):
+    """Read the whole file; returns (header, rows) or raises SnapshotError."""
+    rows = sum(len(items) for kind, _, items in read_frames(path) if kind == FRAME_ROWS)
+    return read_header(path), rows
+
+
+def snapshot_name(name, kind, when=None):
+    return f"{name}-{(when or datetime.utcnow()).strftime('%Y%m%dT%H%M%S%f')}-{kind}{SUFFIX}"
+
+
+def list_snapshots(directory, name):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                  if f.startswith(name + "-") and f.endswith(SUFFIX))
+
+
+def snapshot_stamp(path):
+    return os.path.basename(path).rsplit("-", 2)[-2]
+
+
+def chain(directory, name, until=None):
+    """[(path, header)] for the newest full snapshot and the unbroken incrementals after it.
+
+    until is a timestamp prefix such as "20261019T0930"; newer files are ignored.
+    """
+    current = []
+    for path in list_snapshots(directory, name):
+        if until and snapshot_stamp(path)[:len(until)] > until:
+            break
+        header = read_header(path)
+        if header["kind"] == "full":
+            current = [(path, header)]
+        elif current and header["since"] == current[-1][1]["seq"]:
+            current.append((path, header))
+    return current
+
+
+def prune_snapshots(directory, name, keep_full):
+    """Delete files older than the newest keep_full full snapshots."""
+    paths = list_snapshots(directory, name)
+    fulls = [p for p in paths if read_header(p)["kind"] == "full"]
+    if len(fulls) <= keep_full:
+        return []
+    cutoff = fulls[-keep_full]
+    removed = [p for p in paths if p < cutoff]
+    for p in removed:
+        os.remove(p)
+    return removed
+
+
+# Value encoding. Snapshot values are JSON scalars in the form the source
+# database stores them (SQLite) or prints them (Postgres COPY text); blobs
+# are "\x<hex>" strings. They are converted for the target on restore.
+
+def _kind(column):
+    t = column.type
+    for cls, kind in ((Boolean, "bool"), (DateTime, "datetime"), (Date, "date"), (LargeBinary, "blob"),
+                      (Integer, "int"), (Float, "float")):
+        if isinstance(t, cls):
+            return kind
+    return "text"
+
+
+def _sqlite_datetime(v):
+    v = v.replace("T", " ")
+    if "." not in v:
+        return v + ".000000"
+    head, frac = v.split(".", 1)
+    return f"{head}.{frac[:6].ljust(6, '0')}"
+
+
+_TO_SQLITE = {
+    "int": lambda v: int(v) if isinstance(v, str) else v,
+    "float": lambda v: float(v) if isinstance(v, str) else v,
+    "bool": lambda v: int(v in ("t", "true", "1")) if isinstance(v, str) else int(bool(v)),
+    "datetime": _sqlite_datetime,
+    "blob": lambda v: bytes.fromhex(v[2:]),
+}
+
+_TO_PYTHON = {
+    "int": int,
+    "float": float,
+    "bool": lambda v: v in ("t", "true", "1") if isinstance(v, str) else bool(v),
+    "datetime": lambda v: datetime.fromisoformat(_sqlite_datetime(v)),
+    "date": date.fromisoformat,
+    "blob": lambda v: bytes.fromhex(v[2:]),
+}
+
+
+def _converters(table, columns, target):
+    """[(position, fn)] for the snapshot columns that need converting for target."""
+    by_name = {c.name: c for c in table.columns}
+    convs = []
+    for i, name in enumerate(columns):
+        fn = target.get(_kind(by_name[name])) if name in by_name else None
+        if fn:
+            convs.append((i, fn))
+    return convs
+
+
+def _convert(rows, convs):
+    if not convs:
+        return rows
+    out = []
+    for row in rows:
+        row = list(row)
+        for i, fn in convs:
+            if row[i] is not None:
+                row[i] = fn(row[i])
+        out.append(row)
+    return out
+
+
+_COPY_UNESCAPE = re.compile(r"\\(.)")
+_COPY_CHARS = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+
+
+def _copy_field(s):
+    if s == "\\N":
+        return None
+    return _COPY_UNESCAPE.sub(lambda m: _COPY_CHARS.get(m.group(1), m.group(1)), s) if "\\" in s else s
+
+
+def _copy_text(v):
+    if v is None:
+        return "\\N"
+    return str(v).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+# Reading rows from a source
+
+def _sqlite_batches(conn, table, columns, where="", params=()):
+    blobs = [i for i, c in enumerate(columns) if _kind(table.c[c]) == "blob"]
+    cur = conn.execute(f'SELECT {", ".join(map(_q, columns))} FROM "{table.name}" {where} ORDER BY "{_pk(table)}"', params)
+    while True:
+        rows = cur.fetchmany(BATCH_ROWS)
+        if not rows:
+            return
+        if blobs:
+            rows = [list(r) for r in rows]
+            for r in rows:
+                for i in blobs:
+                    if r[i] is not None:
+                        r[i] = "\\x" + bytes(r[i]).hex()
+        yield rows
+
+
+class _CopySink(io.TextIOBase):
+    """File-like target for COPY ... TO STDOUT that hands on parsed rows BATCH_ROWS at a time."""
+
+    def __init__(self, on_batch):
+        self.on_batch = on_batch
+        self.batch, self.pending = [], ""
+
+    def write(self, data):
+        lines = (self.pending + data).split("\n")
+        self.pending = lines.pop()
+        for line in lines:
+            self.batch.append([_copy_field(f) for f in line.split("\t")])
+            if len(self.batch) >= BATCH_ROWS:
+                self.on_batch(self.batch)
+                self.batch = []
+        return len(data)
+
+    def finish(self):
+        if self.batch:
+            self.on_batch(self.batch)
+            self.batch = []
+
+
+def _pg_copy(cur, table, columns, on_batch, where=""):
+    """COPY the rows out, calling on_batch as they arrive; memory use does not grow with the table."""
+    sink = _CopySink(on_batch)
+    cols = ", ".join(map(_q, columns))
+    cur.copy_expert(f'COPY (SELECT {cols} FROM "{table.name}" {where} ORDER BY "{_pk(table)}") TO STDOUT', sink)
+    sink.finish()
+
+
+def _header(kind, engine, present, seq, since=None, name=None, pg_snapshot=None, tracked=True):
+    return {"version": 1, "kind": kind, "name": name, "dialect": engine.dialect.name,
+            "created_at": datetime.utcnow().isoformat(), "seq": seq, "since": since, "pg_snapshot": pg_snapshot,
+            "tracked": tracked,
+            "tables": [{"name": t.name, "columns": columns} for t, columns in present]}
+
+
+def online_copy(src_path, dst_path, step_pages=STEP_PAGES, pause=STEP_PAUSE, max_restarts=MAX_RESTARTS):
+    """Copy a live SQLite file with the backup API; returns how often the copy restarted.
+
+    In WAL mode the copy is one step: it reads a snapshot and blocks no one.
+    Otherwise it goes step_pages at a time, pausing so writers can commit.
+    A write from another connection restarts the copy; after max_restarts it
+    raises SnapshotError instead of finishing in one step, which would hold
+    a read lock and block every writer until the copy is done.
+    """
+    src, dst = sqlite3.connect(src_path, timeout=30), sqlite3.connect(dst_path)
+    state = {"remaining": None, "restarts": 0}
+
+    class TooBusy(Exception):
+        pass
+
+    def progress(status, remaining, total):
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > max_restarts:
+                raise TooBusy()
+        state["remaining"] = remaining
+        if pause:
+            time.sleep(pause)
+
+    try:
+        if src.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal":
+            src.backup(dst)
+        else:
+            try:
+                src.backup(dst, pages=step_pages, progress=progress)
+            except TooBusy:
+                raise SnapshotError(f"{src_path} kept changing during the copy ({max_restarts} restarts); "
+                                    "retry later or run SQLite in WAL mode") from None
+    finally:
+        src.close()
+        dst.close()
+    return state["restarts"]
+
+
+def _sqlite_path(engine):
+    path = engine.url.database
+    if engine.dialect.name != "sqlite" or not path or path == ":memory:":
+        raise SnapshotError(f"Cannot snapshot {engine.url!r}")
+    return path
+
+
+def snapshot_full(engine, tables, path, name=None, track=True):
+    """Write a full snapshot of tables; returns (rows written, header).
+
+    With track, change tracking is installed so incrementals can follow;
+    without it, tracking is removed and the snapshot can't start a chain.
+    """
+    present = _existing(engine, tables)
+    if track:
+        install_tracking(engine, [t for t, _ in present])
+    else:
+        drop_tracking(engine, [t for t, _ in present])
+    if engine.dialect.name == "postgresql":
+        raw = engine.raw_connection()
+        try:
+            cur = raw.cursor()
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            cur.execute("SET LOCAL bytea_output = 'hex'")
+            seq, pg_snapshot = 0, None
+            if track:
+                cur.execute(f"SELECT coalesce(max(id), 0), pg_current_snapshot()::text FROM {CHANGE_TABLE}")
+                seq, pg_snapshot = cur.fetchone()
+            writer = SnapshotWriter(path, _header("full", engine, present, seq, name=name, pg_snapshot=pg_snapshot,
+                                                  tracked=track))
+            try:
+                for i, (t, columns) in enumerate(present):
+                    _pg_copy(cur, t, columns, lambda rows: writer.rows_frame(i, rows))
+            except BaseException:
+                writer.abort()
+                raise
+        finally:
+            raw.rollback()
+            raw.close()
+        writer.close()
+        return writer.rows, read_header(path)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(path) or ".") as tmp:
+        copy_path = os.path.join(tmp, "copy.db")
+        online_copy(_sqlite_path(engine), copy_path)
+        conn = sqlite3.connect(copy_path)
+        try:
+            seq = conn.execute(f"SELECT coalesce(max(id), 0) FROM {CHANGE_TABLE}").fetchone()[0] if track else 0
+            writer = SnapshotWriter(path, _header("full", engine, present, seq, name=name, tracked=track))
+            try:
+                for i, (t, columns) in enumerate(present):
+                    for rows in _sqlite_batches(conn, t, columns):
+                        writer.rows_frame(i, rows)
+            except BaseException:
+                writer.abort()
+                raise
+        finally:
+            conn.close()
+    writer.close()
+    return writer.rows, read_header(path)
+
+
+def snapshot_incremental(engine, tables, path, since, name=None, since_snapshot=None):
+    """Write the rows changed after sequence number since; returns (rows written, header).
+
+    Postgres hands out change ids before commit, so a change with an id at
+    or below since may have committed only after the previous snapshot was
+    taken. There the previous snapshot's pg_snapshot decides instead: every
+    change it could not see is included.
+    """
+    present = _existing(engine, tables)
+    install_tracking(engine, [t for t, _ in present])
+    if engine.dialect.name == "postgresql":
+        raw = engine.raw_connection()
+        cur = raw.cursor()
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        cur.execute("SET LOCAL bytea_output = 'hex'")
+
+        def run(sql, params=()):
+            cur.execute(sql.replace("?", "%s"), params)
+            return cur
+
+        each_batch = lambda t, columns, where, on_batch: _pg_copy(cur, t, columns, on_batch, where)
+    else:
+        # One short read transaction, so the rows match the change log
+        raw = sqlite3.connect(_sqlite_path(engine), timeout=30, isolation_level=None)
+        raw.execute("BEGIN")
+        run = raw.execute
+
+        def each_batch(t, columns, where, on_batch):
+            for rows in _sqlite_batches(raw, t, columns, where):
+                on_batch(rows)
+    try:
+        if engine.dialect.name == "postgresql":
+            if since_snapshot is None:
+                raise SnapshotError("The previous snapshot has no pg_snapshot; take a full snapshot")
+            seq, pg_snapshot = run(f"SELECT coalesce(max(id), 0), pg_current_snapshot()::text FROM {CHANGE_TABLE}").fetchone()
+            rows = run(f"SELECT DISTINCT tbl, row_id FROM {CHANGE_TABLE} "
+                       "WHERE id > ? OR NOT pg_visible_in_snapshot(xid, CAST(? AS pg_snapshot))", (since, since_snapshot))
+        else:
+            seq, pg_snapshot = run(f"SELECT coalesce(max(id), 0) FROM {CHANGE_TABLE}").fetchone()[0], None
+            rows = run(f"SELECT DISTINCT tbl, row_id FROM {CHANGE_TABLE} WHERE id > ? AND id <= ?", (since, seq))
+        changed = {}
+        for tbl, row_id in rows.fetchall():
+            changed.setdefault(tbl, set()).add(row_id)
+        present = [(t, columns) for t, columns in present if t.name in changed]
+        writer = SnapshotWriter(path, _header("incremental", engine, present, seq, since=since, name=name,
+                                              pg_snapshot=pg_snapshot))
+        try:
+            for i, (t, columns) in enumerate(present):
+                ids = sorted(changed[t.name])
+                pk_pos = columns.index(_pk(t))
+                found = set()
+
+                def take(rows):
+                    found.update(int(r[pk_pos]) for r in rows)
+                    writer.rows_frame(i, rows)
+
+                for start in range(0, len(ids), 500):
+                    where = f'WHERE "{_pk(t)}" IN ({", ".join(str(int(x)) for x in ids[start:start + 500])})'
+                    each_batch(t, columns, where, take)
+                writer.deletes_frame(i, [x for x in ids if x not in found])
+        except BaseException:
+            writer.abort()
+            raise
+    finally:
+        raw.rollback()
+        raw.close()
+    writer.close()
+    return writer.rows, read_header(path)
+
+
+# Restore
+
+def _check_chain(paths):
+    headers = [read_header(p) for p in paths]
+    if not headers or headers[0]["kind"] != "full":
+        raise SnapshotError("A restore starts from a full snapshot")
+    for prev, cur in zip(headers, headers[1:]):
+        if cur["kind"] != "incremental" or cur["since"] != prev["seq"]:
+            raise SnapshotError("Snapshots do not form an unbroken chain")
+    return headers
+
+
+def _create_sqlite_schema(conn, tables):
+    dialect = sqlite_dialect.dialect()
+    for t in tables:
+        conn.execute(str(CreateTable(t).compile(dialect=dialect)))
+        for index in t.indexes:
+            conn.execute(str(CreateIndex(index).compile(dialect=dialect)))
+
+
+def restore_full(engine, tables, paths):
+    """Replace the contents of tables with the state at the end of the chain; returns rows restored.
+
+    SQLite is rebuilt in a side file and copied over the live database with
+    the backup API in one step. Postgres is restored with COPY in a single
+    transaction. Either way readers see the old data or the new, never a mix.
+    """
+    headers = _check_chain(paths)
+    by_name = {t.name: t for t in tables}
+    columns = {}
+    for h in headers:
+        for t in h["tables"]:
+            if t["name"] not in by_name or not set(t["columns"]) <= set(by_name[t["name"]].c.keys()):
+                raise SnapshotError(f"Snapshot table {t['name']} does not match the current schema")
+            columns[t["name"]] = t["columns"]
+    if engine.dialect.name == "postgresql":
+        install_tracking(engine, tables)  # the restore truncates row_change and pauses its triggers
+        return _restore_full_pg(engine, tables, paths, columns)
+
+    target = _sqlite_path(engine)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(target)) as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "restore.db"), isolation_level=None)
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("BEGIN")
+        _create_sqlite_schema(conn, tables)
+        total = 0
+        for path in paths:
+            for kind, name, items in read_frames(path):
+                t = by_name[name]
+                pk = _pk(t)
+                if kind == FRAME_DELETES:
+                    conn.executemany(f'DELETE FROM "{name}" WHERE "{pk}" = ?', [(x,) for x in items])
+                    continue
+                cols = columns[name]
+                rows = _convert(items, _converters(t, cols, _TO_SQLITE))
+                conn.executemany(f'INSERT OR REPLACE INTO "{name}" ({", ".join(map(_q, cols))}) '
+                                 f'VALUES ({", ".join("?" * len(cols))})', rows)
+                total += len(rows)
+        for stmt in tracking_ddl("sqlite", tables):
+            conn.execute(stmt)
+        conn.execute("COMMIT")
+        live = sqlite3.connect(target, timeout=30)
+        try:
+            conn.backup(live)
+        finally:
+            live.close()
+            conn.close()
+    engine.dispose()  # pooled connections may hold the replaced schema
+    return total
+
+
+def _restore_full_pg(engine, tables, paths, columns):
+    raw = engine.raw_connection()
+    total = 0
+    try:
+        cur = raw.cursor()
+        names = ", ".join(f'"{t.name}"' for t in tables)
+        cur.execute(f"TRUNCATE {names}, {CHANGE_TABLE}")
+        for t in tables:
+            cur.execute(f'ALTER TABLE "{t.name}" DISABLE TRIGGER {CHANGE_TABLE}_{t.name}')
+        by_name = {t.name: t for t in tables}
+        for path in paths:
+            for kind, name, items in read_frames(path):
+                pk = _pk(by_name[name])
+                if kind == FRAME_DELETES:
+                    cur.execute(f'DELETE FROM "{name}" WHERE "{pk}" = ANY(%s)', (items,))
+                    continue
+                cols = columns[name]
+                if path != paths[0]:
+                    # Incremental rows replace the existing ones
+                    pk_pos = cols.index(pk)
+                    cur.execute(f'DELETE FROM "{name}" WHERE "{pk}" = ANY(%s)', ([int(r[pk_pos]) for r in items],))
+                buf = io.StringIO("".join("\t".join(_copy_text(v) for v in r) + "\n" for r in items))
+                cur.copy_expert(f'COPY "{name}" ({", ".join(map(_q, cols))}) FROM STDIN', buf)
+                total += len(items)
+        for t in tables:
+            cur.execute(f'ALTER TABLE "{t.name}" ENABLE TRIGGER {CHANGE_TABLE}_{t.name}')
+            pk = _pk(t)
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('\"{t.name}\"', '{pk}'), "
+                        f'coalesce((SELECT max("{pk}") FROM "{t.name}"), 0) + 1, false) '
+                        f"WHERE pg_get_serial_sequence('\"{t.name}\"', '{pk}') IS NOT NULL")
+        raw.commit()
+    except BaseException:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    return total
+
+
+def user_rows(paths, tables, user_id):
+    """{table name: {id: row dict}} for one user as of the end of the chain."""
+    _check_chain(paths)
+    by_name = {t.name: t for t in tables}
+    state = {}
+    for path in paths:
+        columns = {t["name"]: t["columns"] for t in read_header(path)["tables"]}
+        for kind, name, items in read_frames(path):
+            t = by_name.get(name)
+            if t is None or "user_id" not in t.c:
+                continue
+            rows = state.setdefault(name, {})
+            if kind == FRAME_DELETES:
+                for x in items:
+                    rows.pop(x, None)
+                continue
+            cols = columns[name]
+            pk_pos, owner_pos = cols.index(_pk(t)), cols.index("user_id")
+            for r in items:
+                row_id = int(r[pk_pos])
+                if r[owner_pos] is not None and int(r[owner_pos]) == user_id:
+                    rows[row_id] = dict(zip(cols, r))
+                else:
+                    rows.pop(row_id, None)  # the row changed owner
+    return state
+
+
+def restore_user(conn, tables, state, user_id, remap=None):
+    """Replace one user's rows in tables (dependency order) with state, from user_rows().
+
+    Runs on conn inside the caller's transaction. A row whose id was taken
+    by someone else since the snapshot gets a new id; remap works as in
+    sharding.move_user(). Refuses an empty state rather than delete
+    everything. Returns {table name: rows restored}.
+    """
+    if not any(state.values()):
+        raise SnapshotError(f"No rows for user {user_id} in the snapshot")
+    remap = remap or {}
+    new_ids, counts = {}, {}
+    owned = [t for t in tables if "user_id" in t.c]
+    for t in reversed(owned):
+        conn.execute(t.delete().where(t.c.user_id == user_id))
+    for t in owned:
+        pk = _pk(t)
+        rows = state.get(t.name, {})
+        convs = {c.name: _TO_PYTHON.get(_kind(c)) for c in t.columns}
+        refs = {column: new_ids.get(target, {}) for (table_name, column), target in remap.items() if table_name == t.name}
+        taken = set()
+        if rows:
+            taken = set(conn.execute(select(t.c[pk]).where(t.c[pk].in_(list(rows)))).scalars())
+        mapping = new_ids.setdefault(t.name, {})
+        for row_id, row in rows.items():
+            data = {k: (convs[k](v) if v is not None and convs.get(k) else v) for k, v in row.items() if k in t.c}
+            for column, lookup in refs.items():
+                if data.get(column) in lookup:
+                    data[column] = lookup[data[column]]
+            if row_id in taken:
+                data.pop(pk)
+            mapping[row_id] = conn.execute(t.insert().values(**data)).inserted_primary_key[0]
+        counts[t.name] = len(rows)
+    return counts
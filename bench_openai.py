@@ -0,0 +1,49 @@
+"""Exercise the OpenAI guard against the fake client: healthy, slow, failing, recovered.
+
+Usage: python bench_openai.py
+
+Runs analyze_symptoms() through each phase with the fake client's latency and
+error rate changed in place, printing how long callers waited, where answers
+came from, and what the breaker did.
+"""
+import os, time, statistics
+
+os.environ.setdefault("OPENAI_FAKE", "200,0")
+os.environ.setdefault("OPENAI_DEADLINE_SECONDS", "1.0")
+os.environ.setdefault("OPENAI_HEDGE_MARGIN_SECONDS", "0.2")
+os.environ.setdefault("OPENAI_BREAKER_FAILURES", "3")
+os.environ.setdefault("OPENAI_BREAKER_RESET_SECONDS", "2")
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+import app
+
+# name, fake latency ms, fake error rate, calls, wait for the breaker to half-open first
+PHASES = [
+    ("healthy", 200, 0.0, 10, False),
+    ("slow (3s)", 3000, 0.0, 10, False),
+    ("erroring", 100, 1.0, 10, True),
+    ("recovered", 200, 0.0, 10, True),
+]
+
+
+def main():
+    fake = app.client
+    for name, latency_ms, error_rate, calls, wait_reset in PHASES:
+        if wait_reset:
+            time.sleep(app.ai_breaker.reset_seconds)
+        fake.latency_ms, fake.error_rate = latency_ms, error_rate
+        waits, sources = [], {}
+        for _ in range(calls):
+            t0 = time.perf_counter()
+            result = app.analyze_symptoms("mild headache and cough", "Age: 40")
+            waits.append((time.perf_counter() - t0) * 1000)
+            key = result["source"] + (" (hedged)" if result.get("hedged") else "")
+            sources[key] = sources.get(key, 0) + 1
+        breaker = app.ai_breaker.snapshot()
+        print(f"{name:<11} wait p50 {statistics.median(waits):7.1f} ms  max {max(waits):7.1f} ms  "
+              f"breaker {breaker['state']:<9} sources {sources}")
+    print(app.ai_stats.snapshot())
+
+
+if __name__ == "__main__":
+    main()
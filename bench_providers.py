@@ -0,0 +1,95 @@
+"""Benchmark nearest-provider queries on a synthetic directory.
+
+Usage: python bench_providers.py [providers] [queries]
+
+Writes a synthetic CSV clustered around US metro areas, loads it through
+providers.load_directory(), and times nearest(n=10) queries with and without
+a specialty filter, then from points far outside the data (where the ring
+walk would otherwise cross mostly empty cells), and on a second directory
+straddling the antimeridian. Answers are checked against a brute-force scan.
+"""
+import os, sys, csv, time, random, tempfile, statistics
+import providers
+
+METROS = [(40.71, -74.00), (34.05, -118.24), (41.88, -87.63), (29.76, -95.37), (33.45, -112.07),
+          (39.95, -75.17), (32.72, -117.16), (32.78, -96.80), (37.77, -122.42), (47.61, -122.33),
+          (39.74, -104.99), (42.36, -71.06), (25.76, -80.19), (33.75, -84.39), (44.98, -93.27)]
+FAR = [("central US", 39.0, -100.0), ("London", 51.5, -0.13), ("Sydney", -33.9, 151.2)]
+SPECIALTIES = ["Primary Care"] * 6 + ["Cardiology", "Dermatology", "Emergency Medicine", "Urgent Care",
+               "Neurology", "Orthopedics", "Pediatrics", "Psychiatry", "Gastroenterology", "Endocrinology"]
+
+
+def random_point(rng):
+    if rng.random() < 0.8:
+        lat, lon = rng.choice(METROS)
+        return lat + rng.gauss(0, 0.3), lon + rng.gauss(0, 0.3)
+    return rng.uniform(25, 49), rng.uniform(-124, -67)
+
+
+def brute_force(directory, lat, lon, n, specialty, accepting=False):
+    key = providers.normalize_specialty(specialty) if specialty else None
+    scored = [(providers.haversine_km(lat, lon, p["lat"], p["lon"]), i) for i, p in enumerate(directory.providers)
+              if (key is None or p["specialty_key"] == key) and (p["accepting_new_patients"] or not accepting)]
+    return [round(d, 2) for d, _ in sorted(scored)[:n]]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300_000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000
+    rng = random.Random(7)
+    path = os.path.join(tempfile.mkdtemp(), "providers.csv")
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["name", "specialty", "lat", "lon", "accepting_new_patients", "address", "phone"])
+        for i in range(count):
+            lat, lon = random_point(rng)
+            w.writerow([f"Provider {i}", rng.choice(SPECIALTIES), f"{lat:.5f}", f"{lon:.5f}",
+                        "yes" if rng.random() < 0.7 else "no", f"{i} Main St", ""])
+
+    t0 = time.perf_counter()
+    directory = providers.load_directory(path)
+    print(f"Loaded {len(directory):,} providers in {time.perf_counter() - t0:.2f}s (index swap is one assignment)")
+
+    points = [random_point(rng) for _ in range(queries)]
+    for label, specialty, accepting in (("any", None, False), ("cardiology", "Cardiology", False),
+                                        ("primary care, accepting", "Primary Care", True)):
+        samples = []
+        for lat, lon in points:
+            t0 = time.perf_counter()
+            directory.nearest(lat, lon, n=10, specialty=specialty, accepting_only=accepting)
+            samples.append((time.perf_counter() - t0) * 1000)
+        samples.sort()
+        print(f"  {label:<26} p50 {statistics.median(samples):6.3f} ms   p99 {samples[int(len(samples) * 0.99)]:6.3f} ms")
+
+    for name, lat, lon in FAR:
+        for specialty, accepting in ((None, False), ("Cardiology", True)):
+            t0 = time.perf_counter()
+            got = [p["distance_km"] for p in directory.nearest(lat, lon, n=10, specialty=specialty, accepting_only=accepting)]
+            ms = (time.perf_counter() - t0) * 1000
+            ok = got == brute_force(directory, lat, lon, 10, specialty, accepting)
+            label = f"{name}, {'cardiology accepting' if specialty else 'any'}"
+            print(f"  {label:<26} {ms:8.3f} ms   ({'matches' if ok else 'DIFFERS from'} brute force)")
+
+    mismatches = 0
+    for lat, lon in points[:20]:
+        got = [p["distance_km"] for p in directory.nearest(lat, lon, n=10, specialty="Cardiology")]
+        mismatches += got != brute_force(directory, lat, lon, 10, "Cardiology")
+    t0 = time.perf_counter()
+    brute_force(directory, *points[0], 10, "Cardiology")
+    print(f"  brute-force scan           {(time.perf_counter() - t0) * 1000:6.1f} ms   ({mismatches} mismatches in 20 checks)")
+
+    # Fiji, the Aleutians, New Zealand: neighbours sit on both sides of lon 180
+    pacific = providers.ProviderDirectory([
+        {"name": f"Pacific {i}", "specialty": "Primary Care", "specialty_key": "primary care",
+         "lat": rng.uniform(-50, 65), "lon": rng.choice((rng.uniform(170, 180), rng.uniform(-180, -170))),
+         "accepting_new_patients": True, "address": "", "phone": ""} for i in range(2_000)])
+    mismatches = 0
+    for _ in range(300):
+        lat, lon = rng.uniform(-50, 65), rng.choice((179.99, -179.99))
+        got = [p["distance_km"] for p in pacific.nearest(lat, lon, n=10)]
+        mismatches += got != brute_force(pacific, lat, lon, 10, None)
+    print(f"  antimeridian               {mismatches} mismatches in 300 checks")
+
+
+if __name__ == "__main__":
+    main()
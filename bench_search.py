@@ -0,0 +1,90 @@
+"""Benchmark the full-text search index against naive LIKE scans.
+
+Usage: python bench_search.py [rows] [users]
+
+Builds a throwaway SQLite database with a skewed user distribution (one
+"clinic tenant" owns a fifth of all rows), then times the same prefix queries
+through search.search() and through LIKE '%term%' over the source table.
+"""
+import os, sys, time, random, itertools, tempfile, statistics
+from sqlalchemy import create_engine, text
+import search
+
+COMMON = ("metformin lisinopril atorvastatin amlodipine omeprazole levothyroxine sertraline "
+          "breakfast dinner bedtime morning evening food water dizziness nausea headache "
+          "cardiology clinic pharmacy refill blood pressure sugar kidney liver follow "
+          "smith johnson garcia nguyen patel walking diet sleep knee back shoulder").split()
+QUERIES = ["metf", "blood press", "smith card", "refill pharm", "qzx", "zzzz"]
+
+
+def vocabulary(rng, size=20_000):
+    """Common clinical words plus synthetic ones, with Zipf-like frequencies."""
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = COMMON + ["".join(rng.choice(letters) for _ in range(rng.randint(4, 10))) for _ in range(size)]
+    weights = [1.0 / (rank + 10) for rank in range(len(words))]
+    return words, list(itertools.accumulate(weights))
+
+
+def sentence(rng, vocab, n):
+    words, cum = vocab
+    return " ".join(rng.choices(words, cum_weights=cum, k=n))
+
+
+def timed(fn, repeat=20):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000
+    rng = random.Random(42)
+    vocab = vocabulary(rng)
+    path = os.path.join(tempfile.mkdtemp(), "bench_search.db")
+    engine = create_engine(f"sqlite:///{path}")
+
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE note (id INTEGER PRIMARY KEY, user_id INTEGER, title TEXT, body TEXT)"))
+        conn.execute(text("CREATE INDEX ix_note_user ON note (user_id)"))
+        search.ensure_schema(conn)
+
+    print(f"Loading {rows:,} rows for {users:,} users into {path}")
+    t0 = time.perf_counter()
+    batch = []
+    for i in range(1, rows + 1):
+        user_id = 1 if rng.random() < 0.2 else rng.randint(2, users)
+        batch.append({"id": i, "user_id": user_id, "title": sentence(rng, vocab, 3), "body": sentence(rng, vocab, 25)})
+        if len(batch) == 10_000 or i == rows:
+            with engine.begin() as conn:
+                conn.execute(text("INSERT INTO note VALUES (:id, :user_id, :title, :body)"), batch)
+                search.upsert_documents(conn, [("profile", r["id"], r["user_id"], r["title"], r["body"]) for r in batch])
+            batch = []
+    print(f"  load + index: {time.perf_counter() - t0:.1f}s, db size {os.path.getsize(path) / 1e6:.0f} MB")
+
+    with engine.connect() as conn:
+        t0 = time.perf_counter()
+        for i in range(1, 1001):
+            search.upsert_document(conn, "profile", i, 1, sentence(rng, vocab, 3), sentence(rng, vocab, 25))
+        conn.commit()
+        print(f"  incremental upsert: {(time.perf_counter() - t0):.3f} ms/doc\n")
+
+        # LIKE has no ranking, so it must read every matching row of the user's history
+        print(f"{'query':<14}{'user':<8}{'fts ms':>10}{'like ms':>10}{'matches':>9}")
+        for user_id, label in ((1, "tenant"), (users // 2, "typical")):
+            for q in QUERIES:
+                terms = search.query_terms(q)
+                like_sql = text("SELECT id FROM note WHERE user_id = :u AND "
+                                + " AND ".join(f"(title || ' ' || body) LIKE :t{i}" for i in range(len(terms))))
+                like_params = {"u": user_id, **{f"t{i}": f"%{t}%" for i, t in enumerate(terms)}}
+                fts_ms = timed(lambda: search.search(conn, user_id, q, limit=20))
+                like_ms = timed(lambda: conn.execute(like_sql, like_params).fetchall(), repeat=5)
+                matches = len(conn.execute(like_sql, like_params).fetchall())
+                print(f"{q:<14}{label:<8}{fts_ms:>10.2f}{like_ms:>10.2f}{matches:>9}")
+
+
+if __name__ == "__main__":
+    main()
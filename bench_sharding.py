@@ -0,0 +1,140 @@
+"""Benchmark write throughput of one SQLite database against N SQLite shards.
+
+Usage: python bench_sharding.py [shards] [workers] [seconds]
+
+Like gunicorn, each writer is its own process importing the app (sharding is
+chosen at import time from SHARD_DATABASE_URLS). Writers insert reminders for
+random users through the ORM, one commit per reminder, so every write also
+updates the search index as a request would. The sharded run is repeated
+while another process moves users between shards, and afterwards every
+committed reminder must be found on its user's current shard.
+"""
+import os, sys, json, time, random, tempfile, subprocess
+
+USERS = 300
+
+
+def load_app():
+    import app as A
+    return A
+
+
+def setup():
+    A = load_app()
+    A.bootstrap_db()
+    with A.app.app_context():
+        for i in range(USERS):
+            A.db.session.add(A.User(email=f"bench{i}@example.com", password_hash="x"))
+        A.db.session.commit()
+
+
+def write(seed, seconds):
+    from datetime import datetime, timedelta
+    from sqlalchemy.exc import OperationalError
+    import sharding
+    A = load_app()
+    rng = random.Random(seed)
+    committed, counts = {}, {"commits": 0, "locked": 0, "moved": 0}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        uid = rng.randint(1, USERS)
+        with A.app.app_context():
+            try:
+                A.db.session.add(A.Reminder(user_id=uid, title=f"Take pill {rng.randint(1, 999)}",
+                                            due_at=datetime.utcnow() + timedelta(days=1), notes="with food"))
+                A.db.session.commit()
+                counts["commits"] += 1
+                committed[uid] = committed.get(uid, 0) + 1
+            except sharding.UserMoved:
+                counts["moved"] += 1
+            except OperationalError:
+                counts["locked"] += 1
+            finally:
+                A.db.session.rollback()
+    print(json.dumps({"counts": counts, "committed": committed}))
+
+
+def move(count):
+    A = load_app()
+    rng = random.Random(7)
+    timings = []
+    time.sleep(0.5)  # let the writers get going
+    with A.app.app_context():
+        for uid in rng.sample(range(1, USERS + 1), count):
+            target = rng.choice([s for s in A.SHARD_IDS if s != A.shard_router.shard_for_user(uid)])
+            t0 = time.perf_counter()
+            A.move_user_to_shard(uid, target)
+            timings.append((time.perf_counter() - t0) * 1000)
+    print(json.dumps({"timings": timings}))
+
+
+def verify():
+    import sharding
+    A = load_app()
+    found = {}
+    with A.app.app_context():
+        for sid in A.SHARD_IDS or [None]:
+            for r in sharding.on_shard(A.Reminder.query, sid).all():
+                if sid is None or A.shard_router.shard_for_user(r.user_id) == sid:
+                    found[r.user_id] = found.get(r.user_id, 0) + 1
+    print(json.dumps(found))
+
+
+def spawn(env, *args):
+    return subprocess.Popen([sys.executable, __file__, *map(str, args)], env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+
+
+def result(proc):
+    out, _ = proc.communicate()
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(env, workers, seconds, moves=0):
+    procs = [spawn(env, "write", i, seconds) for i in range(workers)]
+    mover = spawn(env, "move", moves) if moves else None
+    outs = [result(p) for p in procs]
+    counts = {k: sum(o["counts"][k] for o in outs) for k in outs[0]["counts"]}
+    committed = {}
+    for o in outs:
+        for uid, n in o["committed"].items():
+            committed[int(uid)] = committed.get(int(uid), 0) + n
+    return counts, committed, result(mover)["timings"] if mover else []
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ("setup", "write", "move", "verify"):
+        mode, args = sys.argv[1], [int(a) for a in sys.argv[2:]]
+        {"setup": setup, "write": write, "move": move, "verify": verify}[mode](*args)
+        return
+    shards = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    seconds = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    # Shards only pay off once writers wait on locks or fsync rather than CPU
+    print(f"{workers} writer processes on {os.cpu_count()} CPUs, {seconds}s per run, {USERS} users")
+
+    for n in (1, shards):
+        tmp = tempfile.mkdtemp()
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp}/primary.db",
+                   # One "shard" means sharding off: everything in the primary, as today
+                   SHARD_DATABASE_URLS=",".join(f"sqlite:///{tmp}/shard{i}.db" for i in range(n)) if n > 1 else "")
+        subprocess.run([sys.executable, __file__, "setup"], env=env, check=True, capture_output=True)
+        label = "single database" if n == 1 else f"{n} shards"
+        counts, committed, _ = run(env, workers, seconds)
+        print(f"{label:>16}: {counts['commits'] / seconds:>7.0f} commits/s  ({counts['locked']} lock timeouts)")
+        if n == 1:
+            continue
+
+        counts, moved_committed, timings = run(env, workers, seconds, moves=10)
+        for uid, c in moved_committed.items():
+            committed[uid] = committed.get(uid, 0) + c
+        found = {int(k): v for k, v in result(spawn(env, "verify")).items()}
+        lost = sum(max(0, c - found.get(uid, 0)) for uid, c in committed.items())
+        stray = sum(max(0, c - committed.get(uid, 0)) for uid, c in found.items())
+        print(f"{'':>16}  with {len(timings)} online moves (slowest {max(timings):.0f} ms): "
+              f"{counts['commits'] / seconds:.0f} commits/s, {counts['moved']} writes rejected for retry, "
+              f"{counts['locked']} lock timeouts, {lost} lost, {stray} stray")
+
+
+if __name__ == "__main__":
+    main()
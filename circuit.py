@@ -0,0 +1,128 @@
+"""Circuit breaker, latency tracking and a fake chat client for the OpenAI path.
+
+The breaker trips open after `failure_threshold` consecutive failures
+(errors or missed deadlines). While open, callers skip the remote call and
+use the rule-based answer immediately. After `reset_seconds` one trial call
+is let through (half-open); its outcome closes or re-opens the breaker.
+"""
+import time, random, threading
+from collections import deque
+from types import SimpleNamespace
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_seconds=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._trial_in_flight = False
+
+    def allow(self):
+        """Return True if a call may go out now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.trips += 1
+                self.state = OPEN
+                self.opened_at = self.clock()
+                self._trial_in_flight = False
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.reset_seconds - (self.clock() - self.opened_at)), 1)
+            return {"state": self.state, "consecutive_failures": self.failures, "trips": self.trips,
+                    "retry_in_seconds": retry_in}
+
+
+class LatencyStats:
+    """Outcome counters plus a rolling window of call latencies."""
+
+    def __init__(self, window=500):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        # late = calls that finished after a hedged answer was already returned,
+        # cancelled = hedged calls dropped before they started
+        self.counts = {"success": 0, "error": 0, "hedged": 0, "late": 0, "cancelled": 0, "short_circuit": 0}
+
+    def record(self, outcome, seconds=None):
+        with self._lock:
+            self.counts[outcome] += 1
+            if seconds is not None:
+                self._samples.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            counts = dict(self.counts)
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 1) if samples else None
+
+        return {"counts": counts, "latency_ms": {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99),
+                                                 "samples": len(samples)}}
+
+
+class FakeChatClient:
+    """Stand-in for openai.OpenAI that injects latency and errors.
+
+    Enable with OPENAI_FAKE="latency_ms,error_rate", e.g. "3000,0.2". Only
+    client.chat.completions.create() is implemented.
+    """
+
+    def __init__(self, latency_ms=200, error_rate=0.0, jitter=0.25, seed=None):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    @classmethod
+    def from_spec(cls, spec):
+        parts = [p.strip() for p in spec.split(",")]
+        latency = float(parts[0]) if parts and parts[0] else 200
+        error_rate = float(parts[1]) if len(parts) > 1 and parts[1] else 0.0
+        return cls(latency_ms=latency, error_rate=error_rate)
+
+    def _create(self, timeout=None, **kwargs):
+        self.calls += 1
+        delay = self.latency_ms / 1000 * (1 + self._rng.uniform(-self.jitter, self.jitter))
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Fake OpenAI call timed out after {timeout}s")
+        time.sleep(delay)
+        if self._rng.random() < self.error_rate:
+            raise RuntimeError("Fake OpenAI error (injected)")
+        content = ('{"urgency": "low", "suggested_specialty": "Primary Care", '
+                   '"advice": ["Monitor symptoms"], "lifestyle": ["Rest"], '
+                   '"doctor_search_query": "primary care doctor near me", '
+                   '"disclaimer": "Fake response for local testing"}')
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
@@ -0,0 +1,223 @@
+"""Drug interaction and allergy index.
+
+The JSON dataset in data/interactions.json is compiled once into a binary
+index file: a small JSON header (drug names, aliases, classes, interaction
+records) followed by a sorted table of drug-pair keys. The pair table is
+memory-mapped read-only, so every gunicorn worker shares the same pages, and
+a check costs one binary search per medication already on the user's list.
+"""
+import os, re, json, mmap, struct, bisect, tempfile
+
+MAGIC = b"VGIX0001"
+HEADER = struct.Struct("<8sII")  # magic, meta length, pair count
+
+SEVERITY_RANK = {"minor": 1, "moderate": 2, "major": 3, "contraindicated": 4}
+
+_DOSE_RE = re.compile(r"\b\d+(?:\.\d+)?\s*(?:mg|mcg|g|ml|units?|iu|%)(?=\s|$)")
+_FORM_WORDS = {"tab", "tabs", "tablet", "tablets", "cap", "caps", "capsule", "capsules",
+               "er", "xr", "sr", "dr", "oral", "daily", "hcl", "solution", "injection"}
+_SPLIT_RE = re.compile(r"[,;\n]|\band\b")
+# Filler in allergy entries: "Penicillin allergy", "allergic to sulfa drugs"
+_ALLERGY_WORDS = {"allergy", "allergies", "allergic", "to", "intolerance", "intolerant", "sensitivity"}
+
+
+def normalize_name(name):
+    """Lowercase, strip dosages/dosage forms and punctuation: 'Advil 200mg tabs' -> 'advil'."""
+    s = (name or "").lower()
+    s = _DOSE_RE.sub(" ", s)
+    s = re.sub(r"[^a-z0-9]+", " ", s)
+    return " ".join(t for t in s.split() if t not in _FORM_WORDS)
+
+
+def split_free_text(text):
+    """Split free-text fields like Profile.allergies into individual entries."""
+    return [part.strip() for part in _SPLIT_RE.split(text or "") if part.strip()]
+
+
+def _pair_key(a, b):
+    if a > b:
+        a, b = b, a
+    return (a << 32) | b
+
+
+def compile_dataset(src_path, dst_path):
+    """Compile the JSON dataset into the binary index format. Writes atomically."""
+    with open(src_path) as f:
+        data = json.load(f)
+
+    drugs, aliases, classes = [], {}, {}
+    for i, d in enumerate(data["drugs"]):
+        drug_classes = [normalize_name(c) for c in d.get("classes", [])]
+        drugs.append([d["name"], drug_classes])
+        for alias in [d["name"]] + d.get("aliases", []):
+            aliases.setdefault(normalize_name(alias), i)
+        for c in drug_classes:
+            classes.setdefault(c, []).append(i)
+
+    def expand(term):
+        if normalize_name(term) in classes:
+            return classes[normalize_name(term)]
+        if normalize_name(term) in aliases:
+            return [aliases[normalize_name(term)]]
+        raise ValueError(f"Unknown drug or class in interaction dataset: {term}")
+
+    records, pairs = [], {}
+    for rule in data["interactions"]:
+        rec_id = len(records)
+        records.append([rule["severity"], rule["description"]])
+        rank = SEVERITY_RANK[rule["severity"]]
+        for a in expand(rule["a"]):
+            for b in expand(rule["b"]):
+                if a == b:
+                    continue
+                key = _pair_key(a, b)
+                prev = pairs.get(key)
+                if prev is None or SEVERITY_RANK[records[prev][0]] < rank:
+                    pairs[key] = rec_id
+
+    meta = json.dumps({
+        "version": data.get("version", ""),
+        "drugs": drugs,
+        "aliases": aliases,
+        "allergy_terms": {normalize_name(k): [normalize_name(c) for c in v] for k, v in data.get("allergy_terms", {}).items()},
+        "records": records,
+    }).encode("utf-8")
+    meta += b" " * (-(HEADER.size + len(meta)) % 8)  # keep the key table 8-byte aligned
+
+    keys = sorted(pairs)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dst_path)), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(meta), len(keys)))
+        f.write(meta)
+        f.write(struct.pack(f"<{len(keys)}Q", *keys))
+        f.write(struct.pack(f"<{len(keys)}I", *(pairs[k] for k in keys)))
+    os.replace(tmp, dst_path)
+    return len(keys)
+
+
+class InteractionIndex:
+    def __init__(self, path):
+        self.path = path
+        self.loaded_mtime = os.path.getmtime(path)
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, meta_len, n_pairs = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an interaction index")
+        meta = json.loads(self._mm[HEADER.size:HEADER.size + meta_len])
+        self.version = meta["version"]
+        # Class names are compared in normalize_name() form ("beta-lactam" -> "beta lactam");
+        # normalizing again here also covers indexes compiled before that was the rule
+        self.drugs = [[name, [normalize_name(c) for c in cs]] for name, cs in meta["drugs"]]
+        self.aliases = meta["aliases"]
+        self.allergy_terms = {k: [normalize_name(c) for c in v] for k, v in meta["allergy_terms"].items()}
+        self.records = meta["records"]
+        self.class_names = {c for _, cs in self.drugs for c in cs}
+        start = HEADER.size + meta_len
+        view = memoryview(self._mm)
+        self._keys = view[start:start + 8 * n_pairs].cast("Q")
+        self._recs = view[start + 8 * n_pairs:start + 12 * n_pairs].cast("I")
+
+    def __len__(self):
+        return len(self._keys)
+
+    def resolve(self, name):
+        """Map a free-text medication name to a drug id, or None if unknown.
+
+        Tries the longest leading run of words first, so 'metformin 500 twice daily'
+        still resolves to metformin.
+        """
+        tokens = normalize_name(name).split()
+        for n in range(len(tokens), 0, -1):
+            drug_id = self.aliases.get(" ".join(tokens[:n]))
+            if drug_id is not None:
+                return drug_id
+        return None
+
+    def lookup_pair(self, a, b):
+        key = _pair_key(a, b)
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            severity, description = self.records[self._recs[i]]
+            return severity, description
+        return None
+
+    def allergy_classes(self, allergy):
+        """Return (drug ids, class names) that a single allergy entry rules out."""
+        term = " ".join(t for t in normalize_name(allergy).split() if t not in _ALLERGY_WORDS)
+        if term in self.allergy_terms:
+            return set(), set(self.allergy_terms[term])
+        if term in self.class_names:
+            return set(), {term}
+        drug_id = self.resolve(term)
+        if drug_id is not None:
+            return {drug_id}, set()
+        return set(), set()
+
+    def check(self, new_name, current_names, allergies):
+        """Check one medication against a user's current medications and allergies.
+
+        Returns a list of finding dicts sorted most severe first. Cost is
+        proportional to len(current_names) + len(allergies).
+        """
+        new_id = self.resolve(new_name)
+        if new_id is None:
+            return []
+        drug_name, drug_classes = self.drugs[new_id]
+        findings = []
+
+        for allergy in allergies:
+            ids, classes = self.allergy_classes(allergy)
+            hit = new_id in ids or classes.intersection(drug_classes)
+            if hit:
+                findings.append({
+                    "kind": "allergy",
+                    "severity": "contraindicated",
+                    "drug": drug_name,
+                    "other": allergy,
+                    "message": f"{new_name} conflicts with recorded allergy: {allergy}.",
+                })
+
+        seen = set()
+        for other in current_names:
+            other_id = self.resolve(other)
+            if other_id is None or other_id in seen:
+                continue
+            seen.add(other_id)
+            if other_id == new_id:
+                findings.append({
+                    "kind": "duplicate",
+                    "severity": "moderate",
+                    "drug": drug_name,
+                    "other": other,
+                    "message": f"{new_name} duplicates {other} already on your list.",
+                })
+                continue
+            hit = self.lookup_pair(new_id, other_id)
+            if hit:
+                severity, description = hit
+                findings.append({
+                    "kind": "interaction",
+                    "severity": severity,
+                    "drug": drug_name,
+                    "other": other,
+                    "message": f"{new_name} + {other}: {description}",
+                })
+
+        findings.sort(key=lambda f: -SEVERITY_RANK[f["severity"]])
+        return findings
+
+
+_index = None
+
+
+def get_index(dataset_path, index_path=None):
+    """Return the process-wide index, compiling it first if the dataset is newer."""
+    global _index
+    index_path = index_path or os.path.splitext(dataset_path)[0] + ".idx"
+    if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(dataset_path):
+        compile_dataset(dataset_path, index_path)
+        _index = None
+    if _index is None or _index.path != index_path or os.path.getmtime(index_path) > _index.loaded_mtime:
+        _index = InteractionIndex(index_path)
+    return _index
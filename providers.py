@@ -0,0 +1,308 @@
+"""Local provider directory with specialty and spatial indexes.
+
+Providers are loaded from a CSV file (see data/providers.csv) into one grid
+per specialty plus one for all providers. Each grid buckets providers into
+lat/lon cells sized to that grid's density (columns wrap around at the
+antimeridian); a nearest-N query walks rings of cells outward from the query point and stops as soon as no unvisited cell
+can hold anything closer than the current N-th result. Far from the data
+most of those cells are empty, so after RING_CELLS cells the search switches
+to a best-first walk over a pyramid of blocks of occupied cells, ordered by
+the exact great-circle distance to each block. Empty space then costs
+nothing, wherever the query comes from.
+
+A loaded ProviderDirectory is immutable. Reloading builds a new one off the
+request path and swaps the module-level reference in a single assignment.
+"""
+import os, csv, math, heapq, threading
+from collections import defaultdict
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+CELL_DEGREES = 0.25
+MIN_CELL_DEGREES = 0.01
+TARGET_CELL_SIZE = 64
+RING_CELLS = 1024  # cells the ring walk may visit before switching to the block pyramid
+BLOCK_FANOUT = 8  # cells per block side, and blocks per parent block side
+TOP_BLOCKS = 64
+
+# Free-text specialty names (e.g. from triage) to the directory's canonical names
+SPECIALTY_ALIASES = {
+    "primary care": "primary care",
+    "family medicine": "primary care",
+    "general practice": "primary care",
+    "internal medicine": "primary care",
+    "gp": "primary care",
+    "pcp": "primary care",
+    "cardiologist": "cardiology",
+    "heart": "cardiology",
+    "dermatologist": "dermatology",
+    "skin": "dermatology",
+    "emergency": "emergency medicine",
+    "emergency room": "emergency medicine",
+    "er": "emergency medicine",
+    "urgent care": "urgent care",
+    "neurologist": "neurology",
+    "orthopedist": "orthopedics",
+    "orthopaedics": "orthopedics",
+    "orthopedic surgery": "orthopedics",
+    "pediatrician": "pediatrics",
+    "psychiatrist": "psychiatry",
+    "mental health": "psychiatry",
+    "gastroenterologist": "gastroenterology",
+    "endocrinologist": "endocrinology",
+    "pulmonologist": "pulmonology",
+    "ent": "otolaryngology",
+    "ear nose and throat": "otolaryngology",
+    "obgyn": "obstetrics and gynecology",
+    "ob gyn": "obstetrics and gynecology",
+    "gynecology": "obstetrics and gynecology",
+    "ophthalmologist": "ophthalmology",
+    "urologist": "urology",
+    "allergist": "allergy and immunology",
+    "rheumatologist": "rheumatology",
+}
+
+
+def normalize_specialty(name):
+    s = " ".join((name or "").lower().replace("/", " ").replace("-", " ").replace("&", "and").split())
+    return SPECIALTY_ALIASES.get(s, s)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def box_km(lat, lon, lat0, lat1, lon0, lon1):
+    """Great-circle distance from (lat, lon) to the nearest point of a lat/lon box."""
+    if lon0 <= lon <= lon1 or lon0 <= lon + 360 <= lon1 or lon0 <= lon - 360 <= lon1:
+        return KM_PER_DEGREE * max(lat0 - lat, lat - lat1, 0)
+    dl = min(abs((lon - e + 180) % 360 - 180) for e in (lon0, lon1))
+    # Along the nearest edge meridian the distance is smallest at this latitude
+    p = math.radians(lat)
+    peak = math.degrees(math.atan2(math.sin(p), math.cos(p) * math.cos(math.radians(dl))))
+    return haversine_km(lat, 0, min(max(peak, lat0, -90), lat1, 90), dl)
+
+
+class _Grid:
+    def __init__(self, points, cell_degrees):
+        self.cell_degrees = cell_degrees
+        self.wrap = round(360 / cell_degrees)  # columns around the globe; column -wrap/2 sits east of wrap/2 - 1
+        self.cells = defaultdict(list)
+        for i, lat, lon in points:
+            self.cells[self.cell(lat, lon)].append(i)
+        self.accepting = {}  # cells restricted to providers accepting new patients, set by ProviderDirectory
+        # Pyramid over the occupied cells: levels[k] maps each block to its children one level down
+        self.levels = []
+        keys, span = list(self.cells), 1
+        while len(keys) > TOP_BLOCKS:
+            parents = defaultdict(list)
+            for r, c in keys:
+                parents[(r // BLOCK_FANOUT, c // BLOCK_FANOUT)].append((r, c))
+            span *= BLOCK_FANOUT
+            self.levels.append((span, parents))
+            keys = list(parents)
+        self.top = keys
+        rows = [r for r, _ in self.cells] or [0]
+        cols = [c for _, c in self.cells] or [0]
+        self.min_row, self.max_row = min(rows), max(rows)
+        self.min_col, self.max_col = min(cols), max(cols)
+
+    @classmethod
+    def build(cls, points):
+        """Halve the cell size until a typical provider shares its cell with at most TARGET_CELL_SIZE others."""
+        cell_degrees = CELL_DEGREES
+        while True:
+            grid = cls(points, cell_degrees)
+            sizes = sorted((len(v) for v in grid.cells.values()), reverse=True)
+            covered, typical = 0, 0
+            for size in sizes:
+                covered += size
+                if covered * 2 >= len(points):
+                    typical = size
+                    break
+            if typical <= TARGET_CELL_SIZE or cell_degrees <= MIN_CELL_DEGREES:
+                return grid
+            cell_degrees /= 2
+
+    def cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_degrees)), self.wrap_col(int(math.floor(lon / self.cell_degrees)))
+
+    def wrap_col(self, col):
+        """The column number for col once longitude wraps around at the antimeridian."""
+        half = self.wrap // 2
+        return (col + half) % self.wrap - half
+
+    def col_gap(self, a, b):
+        d = abs(a - b) % self.wrap
+        return min(d, self.wrap - d)
+
+    def bound(self, lat, r):
+        """Lower bound in km on the distance to anything r cells (Chebyshev) from the query's cell."""
+        lat_band = min(89.9, abs(lat) + r * self.cell_degrees)
+        return max(0, r - 1) * self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(lat_band))
+
+    def block_km(self, lat, lon, row, col, span):
+        size = span * self.cell_degrees
+        return box_km(lat, lon, row * size, (row + 1) * size, col * size, (col + 1) * size)
+
+    def ring(self, row, col, r):
+        """Cells r steps (Chebyshev) from (row, col), columns wrapped; r must stay below wrap / 2."""
+        if r == 0:
+            yield row, col
+            return
+        for c in range(col - r, col + r + 1):
+            yield row - r, self.wrap_col(c)
+            yield row + r, self.wrap_col(c)
+        for rr in range(row - r + 1, row + r):
+            yield rr, self.wrap_col(col - r)
+            yield rr, self.wrap_col(col + r)
+
+
+class ProviderDirectory:
+    def __init__(self, providers, source=None):
+        self.source = source
+        self.providers = providers
+        points = defaultdict(list)
+        for i, p in enumerate(providers):
+            points[p["specialty_key"]].append((i, p["lat"], p["lon"]))
+        self.by_specialty = {key: _Grid.build(pts) for key, pts in points.items()}
+        self.all = _Grid.build([pt for pts in points.values() for pt in pts])
+        for grid in [self.all, *self.by_specialty.values()]:
+            for key, ids in grid.cells.items():
+                accepting = [i for i in ids if providers[i]["accepting_new_patients"]]
+                if accepting:
+                    grid.accepting[key] = accepting
+
+    @classmethod
+    def from_csv(cls, path):
+        providers = []
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                try:
+                    lat, lon = float(row["lat"]), float(row["lon"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                providers.append({
+                    "name": row.get("name", "").strip(),
+                    "specialty": row.get("specialty", "").strip(),
+                    "specialty_key": normalize_specialty(row.get("specialty")),
+                    "lat": lat,
+                    "lon": lon,
+                    "accepting_new_patients": row.get("accepting_new_patients", "").strip().lower() in ("1", "true", "yes", "y"),
+                    "address": row.get("address", "").strip(),
+                    "phone": row.get("phone", "").strip(),
+                })
+        return cls(providers, source=path)
+
+    def __len__(self):
+        return len(self.providers)
+
+    @property
+    def specialties(self):
+        return sorted(self.by_specialty)
+
+    def nearest(self, lat, lon, n=10, specialty=None, accepting_only=False, max_km=None):
+        """Return up to n providers nearest to (lat, lon) as dicts with distance_km added.
+
+        With a specialty that the directory does not know, returns [].
+        """
+        if specialty:
+            grid = self.by_specialty.get(normalize_specialty(specialty))
+            if grid is None:
+                return []
+        else:
+            grid = self.all
+        cells = grid.accepting if accepting_only else grid.cells
+        if not cells or n <= 0:
+            return []
+
+        row, col = grid.cell(lat, lon)
+        max_r = max(abs(row - grid.min_row), abs(row - grid.max_row), abs(col - grid.min_col), abs(col - grid.max_col))
+        best = []  # max-heap of (-distance, index), size <= n
+
+        def done(bound):
+            return (len(best) == n and bound > -best[0][0]) or (max_km is not None and bound > max_km)
+
+        def visit(ids):
+            for i in ids:
+                p = self.providers[i]
+                d = haversine_km(lat, lon, p["lat"], p["lon"])
+                if max_km is not None and d > max_km:
+                    continue
+                if len(best) < n:
+                    heapq.heappush(best, (-d, i))
+                elif d < -best[0][0]:
+                    heapq.heapreplace(best, (-d, i))
+
+        for r in range(max_r + 1):
+            if done(grid.bound(lat, r)):
+                break
+            if (2 * r + 1) ** 2 > min(len(cells), RING_CELLS):
+                # Mostly empty space from here on: visit the rest nearest block first
+                top = len(grid.levels)
+                pending = [(grid.block_km(lat, lon, br, bc, grid.levels[-1][0] if top else 1), top, br, bc)
+                           for br, bc in grid.top]
+                heapq.heapify(pending)
+                while pending and not done(pending[0][0]):
+                    _, level, br, bc = heapq.heappop(pending)
+                    if level == 0:
+                        if max(abs(br - row), grid.col_gap(bc, col)) >= r:  # inner rings are done
+                            visit(cells.get((br, bc), ()))
+                        continue
+                    span = grid.levels[level - 2][0] if level > 1 else 1
+                    for cr, cc in grid.levels[level - 1][1][(br, bc)]:
+                        heapq.heappush(pending, (grid.block_km(lat, lon, cr, cc, span), level - 1, cr, cc))
+                break
+            for key in grid.ring(row, col, r):
+                visit(cells.get(key, ()))
+
+        results = []
+        for neg_d, i in sorted(best, reverse=True):
+            p = {k: v for k, v in self.providers[i].items() if k != "specialty_key"}
+            p["distance_km"] = round(-neg_d, 2)
+            results.append(p)
+        return results
+
+
+_directory = None
+_directory_mtime = None
+_failed_mtime = None  # a file version that failed to load; not retried until it changes again
+_reload_lock = threading.Lock()
+
+
+def load_directory(path):
+    """Build a directory from path and swap it in; readers never see a partial index."""
+    global _directory, _directory_mtime
+    mtime = os.path.getmtime(path)
+    directory = ProviderDirectory.from_csv(path)
+    _directory, _directory_mtime = directory, mtime
+    return directory
+
+
+def get_directory(path):
+    """Return the current directory, loading it on first use.
+
+    If the file changed since it was loaded, the old directory keeps serving
+    while a background thread builds the replacement.
+    """
+    if _directory is None or _directory.source != path:
+        with _reload_lock:
+            if _directory is None or _directory.source != path:
+                return load_directory(path)
+        return _directory
+    mtime = os.path.getmtime(path)
+    if mtime not in (_directory_mtime, _failed_mtime) and _reload_lock.acquire(blocking=False):
+        def reload():
+            global _failed_mtime
+            try:
+                load_directory(path)
+            except Exception as e:
+                _failed_mtime = mtime
+                print(f"Provider directory reload from {path} failed, still serving the old one: {e}")
+            finally:
+                _reload_lock.release()
+        threading.Thread(target=reload, daemon=True).start()
+    return _directory
@@ -0,0 +1,115 @@
+"""In-process fan-out hub for server-sent events.
+
+Each process has one ReminderHub. Browser streams subscribe to it and block
+on their own small queue; a single dispatcher thread per process queries the
+database on a fixed interval and publishes to whichever users are connected
+here. Nothing polls per connection, and an idle stream costs one queue.
+"""
+import json, time, queue, threading
+from collections import deque
+
+
+class Subscription:
+    def __init__(self, hub, user_id, maxsize):
+        self.hub = hub
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def get(self, timeout):
+        """Return the next SSE-formatted message, or None after timeout."""
+        try:
+            published_at, message = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.hub.record_latency(time.perf_counter() - published_at)
+        return message
+
+
+class ReminderHub:
+    def __init__(self, queue_size=100, latency_samples=2000):
+        self._lock = threading.Lock()
+        self._subs = {}  # user_id -> set of Subscription
+        self._queue_size = queue_size
+        self._latencies = deque(maxlen=latency_samples)
+        self._dispatcher = None
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, user_id):
+        sub = Subscription(self, user_id, self._queue_size)
+        with self._lock:
+            self._subs.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subs.get(sub.user_id)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.user_id]
+
+    def connected_users(self):
+        with self._lock:
+            return list(self._subs)
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subs.values())
+
+    def publish(self, user_id, event, data):
+        """Queue an event for every open stream of user_id; full queues drop it."""
+        with self._lock:
+            subs = list(self._subs.get(user_id, ()))
+        return self._deliver(subs, event, data)
+
+    def send(self, sub, event, data):
+        """Queue an event for one stream only, e.g. catch-up alerts when it connects."""
+        return self._deliver([sub], event, data)
+
+    def _deliver(self, subs, event, data):
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        now = time.perf_counter()
+        for sub in subs:
+            try:
+                sub.queue.put_nowait((now, message))
+                self.published += 1
+            except queue.Full:
+                self.dropped += 1
+        return len(subs)
+
+    def record_latency(self, seconds):
+        self._latencies.append(seconds)
+
+    def stats(self):
+        samples = sorted(self._latencies)
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 3) if samples else None
+
+        return {
+            "connections": self.connection_count(),
+            "users": len(self.connected_users()),
+            "published": self.published,
+            "dropped": self.dropped,
+            "fanout_latency_ms": {"p50": pct(0.50), "p99": pct(0.99), "samples": len(samples)},
+        }
+
+    def ensure_dispatcher(self, tick, interval):
+        """Start the per-process dispatcher thread once; it calls tick(hub) every interval seconds."""
+        with self._lock:
+            if self._dispatcher is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(interval)
+                    if not self._subs:
+                        continue
+                    try:
+                        tick(self)
+                    except Exception as e:
+                        print(f"Push dispatcher error: {e}")
+
+            self._dispatcher = threading.Thread(target=run, name="reminder-push", daemon=True)
+            self._dispatcher.start()
@@ -0,0 +1,210 @@
+"""Per-user full-text search index.
+
+SQLite uses an FTS5 virtual table, Postgres a table with a stored tsvector
+column behind a GIN index. Both hold one row per searchable record, keyed by
+doc_key(doc_type, doc_id) so an update or delete touches exactly one row.
+
+A query only ever looks at one user's documents, so its cost must not grow
+with everyone else's. On SQLite every indexed word carries its owner
+("u7xwarfarin", see user_terms()), so a prefix query expands over that
+user's terms and doclists only; the original text sits in UNINDEXED
+columns for display. The user id is also the high bits of the rowid, so one
+user's documents are a single rowid range. On Postgres the GIN index covers
+(user_id, tsv) via btree_gin when the extension is available.
+"""
+import re, unicodedata
+from sqlalchemy import text
+
+DOC_TYPES = {"medication": 1, "reminder": 2, "plan": 3, "profile": 4}
+
+# Highlight markers; callers escape the snippet and then swap these for <mark>
+HL_START, HL_END = "\x02", "\x03"
+
+# What FTS5's unicode61 tokenizer treats as a word: letters and digits, not "_"
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+SNIPPET_WORDS = 12
+
+
+USER_SHIFT = 35  # doc ids below 2**32, user ids below 2**28
+
+
+def doc_key(doc_type, doc_id):
+    return doc_id * 8 + DOC_TYPES[doc_type]
+
+
+def fts_rowid(user_id, doc_type, doc_id):
+    return (int(user_id) << USER_SHIFT) | doc_key(doc_type, doc_id)
+
+
+def user_rowids(user_id):
+    """Inclusive rowid range holding one user's documents."""
+    return int(user_id) << USER_SHIFT, ((int(user_id) + 1) << USER_SHIFT) - 1
+
+
+def user_prefix(user_id):
+    return f"u{int(user_id)}x"  # the x ends the id, so u1x... never matches u12x...
+
+
+def user_terms(user_id, s):
+    """Index text for one user's document: every word tagged with the owner."""
+    prefix = user_prefix(user_id)
+    return " ".join(prefix + t for t in _TOKEN_RE.findall(s or ""))
+
+
+def _fold(word):
+    return "".join(c for c in unicodedata.normalize("NFKD", word.lower()) if not unicodedata.combining(c))
+
+
+def make_snippet(body, terms, words=SNIPPET_WORDS):
+    """A window of body around the first word matching a term prefix, with matches marked."""
+    tokens = list(_TOKEN_RE.finditer(body or ""))
+    if not tokens:
+        return ""
+    folded = [_fold(t) for t in terms]
+    hits = [any(_fold(m.group()).startswith(t) for t in folded) for m in tokens]
+    first = hits.index(True) if True in hits else 0
+    start = max(0, min(first - 2, len(tokens) - words))
+    end = min(len(tokens), start + words)
+    out, pos = [], tokens[start].start()
+    for m, hit in zip(tokens[start:end], hits[start:end]):
+        out.append(body[pos:m.start()])
+        out.append(f"{HL_START}{m.group()}{HL_END}" if hit else m.group())
+        pos = m.end()
+    return ("…" if start else "") + "".join(out) + ("…" if end < len(tokens) else "")
+
+
+def _is_postgres(conn):
+    return conn.dialect.name == "postgresql"
+
+
+def ensure_schema(conn):
+    """Create the index if missing; returns True if an old SQLite index was dropped and must be rebuilt."""
+    if _is_postgres(conn):
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS search_document (
+                key BIGINT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                doc_type VARCHAR(20) NOT NULL,
+                doc_id INTEGER NOT NULL,
+                title TEXT NOT NULL DEFAULT '',
+                body TEXT NOT NULL DEFAULT '',
+                tsv tsvector GENERATED ALWAYS AS (
+                    setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+                    setweight(to_tsvector('simple', coalesce(body, '')), 'B')
+                ) STORED
+            )"""))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_search_document_user ON search_document (user_id)"))
+        try:
+            with conn.begin_nested():
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gin"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_search_document_user_tsv "
+                                  "ON search_document USING GIN (user_id, tsv)"))
+            conn.execute(text("DROP INDEX IF EXISTS ix_search_document_tsv"))
+        except Exception:
+            # No btree_gin (or no right to create it): filter on user_id after the tsv match
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_search_document_tsv ON search_document USING GIN (tsv)"))
+        return False
+    columns = [r[1] for r in conn.execute(text("PRAGMA table_info(search_index)"))]
+    stale = bool(columns) and "title_terms" not in columns  # built before words carried their owner
+    if stale:
+        conn.execute(text("DROP TABLE search_index"))
+    conn.execute(text("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            title_terms, body_terms, title UNINDEXED, body UNINDEXED, doc_type UNINDEXED, doc_id UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )"""))
+    return stale
+
+
+_PG_UPSERT = text("""
+    INSERT INTO search_document (key, user_id, doc_type, doc_id, title, body)
+    VALUES (:key, :user_id, :doc_type, :doc_id, :title, :body)
+    ON CONFLICT (key) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body""")
+_FTS_DELETE = text("DELETE FROM search_index WHERE rowid = :rowid")
+_FTS_INSERT = text("""
+    INSERT INTO search_index (rowid, title_terms, body_terms, title, body, doc_type, doc_id)
+    VALUES (:rowid, :title_terms, :body_terms, :title, :body, :doc_type, :doc_id)""")
+
+
+def upsert_document(conn, doc_type, doc_id, user_id, title, body):
+    upsert_documents(conn, [(doc_type, doc_id, user_id, title, body)])
+
+
+def upsert_documents(conn, docs):
+    """Index many (doc_type, doc_id, user_id, title, body) tuples with one executemany per statement."""
+    params = [{"key": doc_key(doc_type, doc_id), "rowid": fts_rowid(user_id, doc_type, doc_id), "user_id": user_id,
+               "doc_type": doc_type, "doc_id": doc_id, "title": title or "", "body": body or ""}
+              for doc_type, doc_id, user_id, title, body in docs]
+    if not params:
+        return
+    if _is_postgres(conn):
+        conn.execute(_PG_UPSERT, params)
+    else:
+        for p in params:
+            p["title_terms"] = user_terms(p["user_id"], p["title"])
+            p["body_terms"] = user_terms(p["user_id"], p["body"])
+        # FTS5 has no upsert; rowid lookups keep the delete cheap
+        conn.execute(_FTS_DELETE, params)
+        conn.execute(_FTS_INSERT, params)
+
+
+def delete_document(conn, doc_type, doc_id, user_id):
+    if _is_postgres(conn):
+        conn.execute(text("DELETE FROM search_document WHERE key = :key"), {"key": doc_key(doc_type, doc_id)})
+    else:
+        conn.execute(_FTS_DELETE, {"rowid": fts_rowid(user_id, doc_type, doc_id)})
+
+
+def delete_user_documents(conn, user_id=None):
+    """Drop one user's documents, or every document when user_id is None."""
+    if _is_postgres(conn):
+        where = "" if user_id is None else "WHERE user_id = :user_id"
+        conn.execute(text(f"DELETE FROM search_document {where}"), {"user_id": user_id})
+    elif user_id is None:
+        conn.execute(text("DELETE FROM search_index"))
+    else:
+        lo, hi = user_rowids(user_id)
+        conn.execute(text("DELETE FROM search_index WHERE rowid BETWEEN :lo AND :hi"), {"lo": lo, "hi": hi})
+
+
+def query_terms(q):
+    """Split a user query into lowercase word tokens; punctuation is dropped."""
+    return [t.lower() for t in _TOKEN_RE.findall(q or "")][:12]
+
+
+def search(conn, user_id, q, limit=20, doc_type=None):
+    """Prefix-match every term of q within one user's documents, best match first.
+
+    Each result is {doc_type, doc_id, title, snippet, score}. Snippets carry
+    HL_START/HL_END markers around matched terms and are not HTML-escaped.
+    """
+    terms = query_terms(q)
+    if not terms:
+        return []
+    params = {"user_id": user_id, "limit": limit, "doc_type": doc_type}
+    if _is_postgres(conn):
+        params["tsq"] = " & ".join(f"{t}:*" for t in terms)
+        params["opts"] = f"StartSel={HL_START}, StopSel={HL_END}, MaxWords=20, MinWords=6"
+        rows = conn.execute(text("""
+            SELECT doc_type, doc_id, title,
+                   ts_headline('simple', body, q, :opts) AS snippet,
+                   ts_rank(tsv, q) AS score
+            FROM search_document, to_tsquery('simple', :tsq) AS q
+            WHERE user_id = :user_id AND tsv @@ q
+              AND (CAST(:doc_type AS VARCHAR) IS NULL OR doc_type = :doc_type)
+            ORDER BY score DESC
+            LIMIT :limit"""), params)
+    else:
+        prefix = user_prefix(user_id)
+        params["match"] = " AND ".join(f'"{prefix}{t}"*' for t in terms)
+        params["lo"], params["hi"] = user_rowids(user_id)
+        rows = conn.execute(text("""
+            SELECT doc_type, doc_id, title, body AS snippet,
+                   -bm25(search_index, 10.0, 1.0) AS score
+            FROM search_index
+            WHERE search_index MATCH :match AND rowid BETWEEN :lo AND :hi
+              AND (:doc_type IS NULL OR doc_type = :doc_type)
+            ORDER BY bm25(search_index, 10.0, 1.0)
+            LIMIT :limit"""), params)
+        return [dict(r._mapping, snippet=make_snippet(r.snippet, terms)) for r in rows]
+    return [dict(r._mapping) for r in rows]
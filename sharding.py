@@ -0,0 +1,231 @@
+"""Optional user-partitioned sharding.
+
+When SHARD_DATABASE_URLS is set, per-user tables live on N shard databases
+and everything else stays on the primary. Rows go to the shard picked by a
+stable hash of user_id, unless the user_shard directory on the primary says
+the user has been moved. Routing uses SQLAlchemy's ShardedSession:
+
+- flushes go to the shard of the instance's user_id
+- queries with a top-level ``user_id == x`` or ``user_id IN (...)`` criterion go
+  to those users' shards; other queries on sharded tables fan out to all shards
+- everything else (users, care teams, the directory) goes to the primary
+
+Row ids are only unique within a shard, so code that pages through a whole
+table must do it one shard at a time (see on_shard()). Fanned-out results
+are concatenated, not merged: count() and other aggregates need a loop
+over shards too.
+"""
+import hashlib
+from sqlalchemy import MetaData, Table, Column, Integer, String, select, func, text, inspect as sa_inspect
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.schema import CreateTable, CreateIndex
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+
+PRIMARY = "primary"
+
+# Left on a shard by move_user() so late writers for a moved user can tell
+tombstones = Table("shard_tombstone", MetaData(),
+                   Column("user_id", Integer, primary_key=True),
+                   Column("moved_to", String(50), nullable=False))
+
+
+def shard_names(count):
+    return [f"shard{i}" for i in range(count)]
+
+
+def hash_shard(user_id, shard_ids):
+    """Stable across processes and restarts, unlike hash(), and spreads sequential ids evenly."""
+    digest = hashlib.blake2b(str(int(user_id)).encode(), digest_size=8).digest()
+    return shard_ids[int.from_bytes(digest, "big") % len(shard_ids)]
+
+
+class ShardRouter:
+    def __init__(self, shard_ids, sharded_tables, lookup):
+        """lookup(user_id) returns the user's directory entry, or None to use the hash."""
+        self.shard_ids = list(shard_ids)
+        self.tables = set(sharded_tables)
+        self.lookup = lookup
+
+    def shard_for_user(self, user_id):
+        return self.lookup(user_id) or hash_shard(user_id, self.shard_ids)
+
+    def is_sharded(self, mapper):
+        return mapper is not None and mapper.local_table.name in self.tables
+
+    def shard_chooser(self, mapper, instance, clause=None):
+        if not self.is_sharded(mapper):
+            return PRIMARY
+        user_id = getattr(instance, "user_id", None)
+        if user_id is None:
+            raise ValueError(f"Cannot choose a shard for {mapper.class_.__name__} without user_id")
+        return self.shard_for_user(user_id)
+
+    def identity_chooser(self, mapper, primary_key, *, lazy_loaded_from, execution_options, bind_arguments, **kw):
+        if lazy_loaded_from is not None and lazy_loaded_from.identity_token is not None:
+            return [lazy_loaded_from.identity_token]
+        return self.shard_ids if self.is_sharded(mapper) else [PRIMARY]
+
+    def execute_chooser(self, orm_context):
+        if not any(self.is_sharded(m) for m in orm_context.all_mappers):
+            return [PRIMARY]
+        user_ids = self._user_ids(orm_context.statement)
+        # Long IN lists (e.g. the push dispatcher) cost a directory lookup each; just fan out
+        if user_ids is None or len(user_ids) > len(self.shard_ids):
+            return self.shard_ids
+        return sorted({self.shard_for_user(u) for u in user_ids})
+
+    def _user_ids(self, statement):
+        """user_ids from a top-level AND-ed user_id criterion, or None if there isn't one."""
+        where = getattr(statement, "whereclause", None)
+        if where is None:
+            return None
+        clauses = where.clauses if isinstance(where, BooleanClauseList) and where.operator is operators.and_ else [where]
+        for c in clauses:
+            if not isinstance(c, BinaryExpression) or not isinstance(c.right, BindParameter):
+                continue
+            table = getattr(c.left, "table", None)
+            if getattr(c.left, "key", None) != "user_id" or getattr(table, "name", None) not in self.tables:
+                continue
+            value = c.right.effective_value
+            if c.operator is operators.eq and value is not None:
+                return [value]
+            if c.operator is operators.in_op and value is not None:
+                return list(value)
+        return None
+
+
+def make_session_class(router_factory):
+    """A ShardedSession that Flask-SQLAlchemy can construct (it passes db=)."""
+
+    class FlaskShardedSession(ShardedSession):
+        def __init__(self, db, **kwargs):
+            router = router_factory()
+            kwargs.pop("query_cls", None)
+            super().__init__(shard_chooser=router.shard_chooser, identity_chooser=router.identity_chooser,
+                             execute_chooser=router.execute_chooser, query_cls=db.Query, **kwargs)
+            self._db = db
+            self.bind_shard(PRIMARY, db.engines[None])
+            for shard_id in router.shard_ids:
+                self.bind_shard(shard_id, db.engines[shard_id])
+
+    return FlaskShardedSession
+
+
+def on_shard(query, shard_id):
+    """Pin a query to one shard; with shard_id None (sharding off) return it unchanged."""
+    return query if shard_id is None else query.execution_options(_sa_shard_id=shard_id)
+
+
+def create_shard_tables(engine, tables):
+    """Create per-user tables on a shard, without foreign keys to primary-only tables."""
+    existing = set(sa_inspect(engine).get_table_names())
+    with engine.begin() as conn:
+        for table in list(tables) + [tombstones]:
+            if table.name in existing:
+                continue
+            conn.execute(CreateTable(table, include_foreign_key_constraints=[]))
+            for index in table.indexes:
+                conn.execute(CreateIndex(index))
+
+
+def user_loads(engine, tables):
+    """Return {user_id: row count} across the given tables on one shard."""
+    loads = {}
+    with engine.connect() as conn:
+        for table in tables:
+            for user_id, count in conn.execute(select(table.c.user_id, func.count()).group_by(table.c.user_id)):
+                loads[user_id] = loads.get(user_id, 0) + count
+    return loads
+
+
+class UserMoved(Exception):
+    """Raised when a write reached a shard that no longer owns the user."""
+
+
+def lock_user(conn, user_id, shared=True):
+    """Serialize writers against move_user() on Postgres; SQLite's write lock already does."""
+    if conn.dialect.name == "postgresql":
+        fn = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+        conn.execute(text(f"SELECT {fn}(:user_id)"), {"user_id": int(user_id)})
+
+
+def move_user(src_engine, dst_engine, target, tables, user_id, set_directory, remap=None):
+    """Copy one user's rows to shard target, flip the directory, then delete the originals.
+
+    tables must be in dependency order. remap maps (table name, column) to
+    the table whose ids that column references, e.g.
+    {("interaction_alert", "medication_id"): "medication"}; ids are reassigned
+    on the target because they are only unique per shard.
+
+    Writers for this user wait on the source until the move commits and then
+    find a tombstone there, see check_owner(). On Postgres that wait comes
+    from an advisory lock, so other users on the shard keep writing. On
+    SQLite it comes from the shard's write lock, held for the whole copy:
+    every writer on the source shard waits (up to its busy timeout) while one
+    user moves, so move large users off-peak. Reads are never blocked.
+    Returns {table name: [(old_id, new_id), ...]}.
+    """
+    remap = remap or {}
+    id_maps = {table.name: [] for table in tables}
+    with src_engine.connect() as src:
+        lock_user(src, user_id, shared=False)
+        # A no-op update takes the write lock (SQLite) before anything is read
+        for table in tables:
+            src.execute(table.update().where(table.c.user_id == user_id).values(user_id=user_id))
+
+        flipped = False
+        try:
+            with dst_engine.begin() as dst:
+                dst.execute(tombstones.delete().where(tombstones.c.user_id == user_id))
+                for table in tables:
+                    rows = src.execute(select(table).where(table.c.user_id == user_id).order_by(table.c.id))
+                    _copy_rows(dst, table, rows, id_maps, remap)
+            set_directory(user_id)
+            flipped = True
+            # Delete and copy in one statement so nothing committed in between is lost
+            leftovers = {}
+            for table in reversed(tables):
+                copied = {old for old, _ in id_maps[table.name]}
+                deleted = src.execute(table.delete().where(table.c.user_id == user_id).returning(*table.c))
+                leftovers[table.name] = [r for r in deleted if r.id not in copied]
+            with dst_engine.begin() as dst:
+                for table in tables:
+                    _copy_rows(dst, table, leftovers[table.name], id_maps, remap)
+            src.execute(tombstones.delete().where(tombstones.c.user_id == user_id))
+            src.execute(tombstones.insert().values(user_id=user_id, moved_to=target))
+            src.commit()
+        except Exception:
+            src.rollback()
+            if not flipped:
+                # The source still owns the user; drop the partial copy
+                with dst_engine.begin() as dst:
+                    for table in reversed(tables):
+                        new_ids = [new for _, new in id_maps[table.name]]
+                        if new_ids:
+                            dst.execute(table.delete().where(table.c.id.in_(new_ids)))
+            raise
+    return id_maps
+
+
+def check_owner(conn, user_id):
+    """Call after writing user_id's rows, inside the same transaction on that shard.
+
+    Raises UserMoved if the user was moved off this shard while the request
+    was routing its writes here.
+    """
+    lock_user(conn, user_id, shared=True)
+    if conn.execute(select(tombstones.c.moved_to).where(tombstones.c.user_id == user_id)).first():
+        raise UserMoved(f"User {user_id} moved to another shard; retry the request")
+
+
+def _copy_rows(dst, table, rows, id_maps, remap):
+    refs = {column: dict(id_maps.get(target, [])) for (table_name, column), target in remap.items() if table_name == table.name}
+    for row in rows:
+        data = dict(row._mapping)
+        old_id = data.pop("id")
+        for column, lookup in refs.items():
+            if data.get(column) is not None:
+                data[column] = lookup.get(data[column], data[column])
+        new_id = dst.execute(table.insert().values(**data)).inserted_primary_key[0]
+        id_maps[table.name].append((old_id, new_id))
@@ -11,6 +11,7 @@ document.addEventListener("DOMContentLoaded", () => {
   const disc = document.getElementById("disc");
   const doctorSearch = document.getElementById("doctorSearch");
   const doctorLink = document.getElementById("doctorLink");
+  const directoryLink = document.getElementById("directoryLink");
 
   console.log("Elements check:", {
     btn: !!btn,
@@ -92,6 +93,7 @@ document.addEventListener("DOMContentLoaded", () => {
         if (doctorSearch && doctorLink && data.google_search_link) {
           doctorSearch.classList.remove("hide");
           doctorLink.href = data.google_search_link;
+          if (directoryLink && data.directory_link) directoryLink.href = data.directory_link;
         } else if (doctorSearch) {
           doctorSearch.classList.add("hide");
         }
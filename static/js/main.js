@@ -5,4 +5,26 @@ document.addEventListener("DOMContentLoaded", () => {
   };
   window.addEventListener("scroll", onScroll);
   onScroll();
+
+  // Live reminder and refill alerts pushed by the server
+  const streamUrl = document.body.dataset.reminderStream;
+  if (streamUrl && window.EventSource) {
+    const toast = (text, category) => {
+      let wrap = document.querySelector(".flash-wrap");
+      if (!wrap) {
+        wrap = document.createElement("div");
+        wrap.className = "flash-wrap";
+        document.body.appendChild(wrap);
+      }
+      const div = document.createElement("div");
+      div.className = `flash ${category} fade-in-down`;
+      div.textContent = text;
+      wrap.appendChild(div);
+      setTimeout(() => div.remove(), 15000);
+    };
+    const source = new EventSource(streamUrl);
+    source.addEventListener("due", (e) => toast(`⏰ ${JSON.parse(e.data).message}`, "error"));
+    source.addEventListener("pre_notify", (e) => toast(`🔔 ${JSON.parse(e.data).message}`, "warning"));
+    source.addEventListener("refill", (e) => toast(`💊 ${JSON.parse(e.data).message}`, "warning"));
+  }
 });